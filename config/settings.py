@@ -54,6 +54,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "trials.middleware.request_latency_middleware",
 ]
 
 ROOT_URLCONF = "config.urls"
@@ -84,8 +85,41 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Keep the connections instead of opening one for each request.
+        "CONN_MAX_AGE": env.int("CONN_MAX_AGE", default=600),
+        "CONN_HEALTH_CHECKS": True,
     }
 }
+# PRAGMAs for each new SQLite connection.
+# With WAL, the API reads a consistent snapshot while the sync writes.
+TRIALS_SQLITE_PRAGMAS = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,  # KiB
+    "busy_timeout": 5000,  # ms
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# The cron process bumps the dataset version after syncing,
+# so the cache must be shared between processes.
+# The dataset version has its own cache,
+# so it is not culled when the responses fill the default cache.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / "cache",
+    },
+    "versions": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / "cache" / "versions",
+    },
+}
+TRIALS_VERSION_CACHE = "versions"
+TRIALS_CACHE_TIMEOUT = 60 * 60
 
 
 # Password validation
@@ -132,13 +166,48 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 # cronjob
 CRONJOBS = [
-    ("* 9 * * *", "trials.cron.log_updated_data"),
-    ("* 18 * * *", "trials.cron.log_updated_data"),
+    ("0 9 * * *", "trials.cron.log_updated_data"),
+    ("0 18 * * *", "trials.cron.log_updated_data"),
 ]
 # For start cronjob, run "python manage.py crontab add"
 # For stop cronjob, run "python manage.py crontab remove"
 
+# The datasets synced into the trials, in order of the sync.
+# A source has "url" and optionally "mapping"(column of API: field of the trials),
+#   which must map a column to "number".
+# The default mapping is the columns of the clinical trials of odcloud.
+TRIALS_SOURCES = {
+    "clinical-trials": {
+        # API_URL can be a local stand-in(see `fakeapi` command).
+        "url": env(
+            "API_URL",
+            default=(
+                "https://api.odcloud.kr/api/3074271/v1/"
+                "uddi:cfc19dda-6f75-4c57-86a8-bb9c8b103887"
+            ),
+        ),
+    },
+}
+# The seconds after the start of the last full sync
+#   after which a sync runs fully even if the probe of API is same(less an hour)
+TRIALS_SYNC_MAX_AGE = 24 * 60 * 60
+# The maximum number of trials looked up by a request
+TRIALS_LOOKUP_LIMIT = 1000
+# How to count the trials of the list for each pagination.
+# One of "exact", "cached", "estimated" and "none"(no count, only the next page)
+TRIALS_COUNT_STRATEGIES = {"limit": "cached", "page": "cached"}
+# Serve the list, detail and lookup with async views.
+# Use it with an ASGI server, e.g. "uvicorn config.asgi:application".
+TRIALS_ASYNC_VIEWS = env.bool("TRIALS_ASYNC_VIEWS", default=False)
+# Serve the list, detail and lookup from all the trials in memory of each worker.
+# It is rebuilt when the dataset version is changed by a sync.
+TRIALS_READ_MODEL = env.bool("TRIALS_READ_MODEL", default=False)
+
 REST_FRAMEWORK = {
+    "DEFAULT_RENDERER_CLASSES": [
+        "trials.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.LimitOffsetPagination",
     "PAGE_SIZE": 5,
 }
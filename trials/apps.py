@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class TrialsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "trials"
+
+    def ready(self):
+        from .db import set_sqlite_pragmas
+        from .readmodel import refresh_read_model
+        from .signals import sync_finished
+
+        connection_created.connect(set_sqlite_pragmas)
+        sync_finished.connect(refresh_read_model)
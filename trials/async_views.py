@@ -0,0 +1,166 @@
+import json
+from asgiref.sync import sync_to_async
+from django.http import HttpRequest, HttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.request import Request
+from rest_framework.status import HTTP_200_OK, HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND
+from .cache import acache_response
+from .models import Trial
+from .pagination import LimitOffsetCountPagination, SequencePagination
+from .readmodel import aget_read_model
+from .renderers import dumps
+from .views import (
+    TrialsView,
+    clean_numbers,
+    find_records,
+    get_lookup_data,
+    get_trials,
+    serializer,
+)
+
+# The views with page and cursor pagination are served by the sync view.
+trials_view = TrialsView.as_view()
+
+
+def json_response(data, status=HTTP_200_OK) -> HttpResponse:
+    """
+    Render the data same as the sync views.
+    """
+    return HttpResponse(dumps(data), status=status, content_type="application/json")
+
+
+class AsyncTrialsView(View):
+    async def get(self, request: HttpRequest) -> HttpResponse:
+        """
+        Async version of TrialsView.
+        Only limit-offset pagination is async,
+            and the others are delegated to TrialsView in a thread.
+        """
+
+        if request.GET.get("pagination", "limit") != "limit":
+            return await sync_to_async(trials_view)(request)
+        return await self.get_page(request)
+
+    @acache_response
+    async def get_page(self, request: HttpRequest) -> HttpResponse:
+        """
+        Get a page of trials like LimitOffsetCountPagination.
+        The trials are found in the read model if it is on.
+        """
+
+        read_model = await aget_read_model()
+        if read_model is not None:
+            try:
+                records = find_records(read_model, request.GET)
+            except ValueError as e:
+                return json_response({"message": str(e)}, status=HTTP_400_BAD_REQUEST)
+            if records is not None:
+                paginator = SequencePagination()
+                page = paginator.paginate_queryset(records, Request(request))
+                return json_response(
+                    {
+                        "count": paginator.count,
+                        "next": paginator.get_next_link(),
+                        "previous": paginator.get_previous_link(),
+                        "results": serializer.serialize(page),
+                    }
+                )
+        try:
+            trials = get_trials(request.GET)
+        except ValueError as e:
+            return json_response({"message": str(e)}, status=HTTP_400_BAD_REQUEST)
+        # Reuse the parameters and links of DRF for the same response.
+        paginator = LimitOffsetCountPagination()
+        paginator.request = Request(request)
+        paginator.limit = paginator.get_limit(paginator.request)
+        paginator.offset = paginator.get_offset(paginator.request)
+        rows = trials.values(*serializer.sources)
+        if paginator.count_strategy == "none":
+            paginator.count = None
+            end = paginator.offset + paginator.limit + 1
+            page = [row async for row in rows[paginator.offset : end]]
+            paginator.has_next = len(page) > paginator.limit
+            page = page[: paginator.limit]
+        else:
+            if paginator.count_strategy == "exact":
+                paginator.count = await rows.acount()
+            else:
+                # The other strategies use the cache or the statistics of DB.
+                paginator.count = await sync_to_async(paginator.get_count)(rows)
+            page = []
+            if paginator.count > paginator.offset:
+                end = paginator.offset + paginator.limit
+                page = [row async for row in rows[paginator.offset : end]]
+        return json_response(
+            {
+                "count": paginator.count,
+                "next": paginator.get_next_link(),
+                "previous": paginator.get_previous_link(),
+                "results": serializer.serialize(page),
+            }
+        )
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncTrialsLookupView(View):
+    async def get(self, request: HttpRequest) -> HttpResponse:
+        """
+        Async version of TrialsLookupView.get.
+        """
+
+        return await self.lookup(request.GET.getlist("number"))
+
+    async def post(self, request: HttpRequest) -> HttpResponse:
+        """
+        Async version of TrialsLookupView.post.
+        """
+
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            data = None
+        numbers = data.get("numbers") if isinstance(data, dict) else None
+        if not isinstance(numbers, list) or not all(
+            isinstance(number, str) for number in numbers
+        ):
+            message = "numbers must be a list of strings."
+            return json_response({"message": message}, status=HTTP_400_BAD_REQUEST)
+        return await self.lookup(numbers)
+
+    async def lookup(self, numbers: list[str]) -> HttpResponse:
+        """
+        Find the trials with a query.
+        """
+        try:
+            numbers = clean_numbers(numbers)
+        except ValueError as e:
+            return json_response({"message": str(e)}, status=HTTP_400_BAD_REQUEST)
+        read_model = await aget_read_model()
+        if read_model is not None:
+            rows = filter(None, map(read_model.get, numbers))
+        else:
+            rows = Trial.objects.filter(number__in=numbers).values(*serializer.sources)
+            rows = [row async for row in rows.aiterator()]
+        return json_response(get_lookup_data(numbers, rows))
+
+
+class AsyncTrialView(View):
+    @acache_response
+    async def get(self, request: HttpRequest, pk: str) -> HttpResponse:
+        """
+        Async version of TrialView.
+        """
+
+        read_model = await aget_read_model()
+        if read_model is not None:
+            row = read_model.get(pk)
+        else:
+            try:
+                row = await Trial.objects.values(*serializer.sources).aget(number=pk)
+            except Trial.DoesNotExist:
+                row = None
+        if row is None:
+            return json_response({"message": "Not found"}, status=HTTP_404_NOT_FOUND)
+        return json_response(serializer.to_representation(row))
@@ -0,0 +1,153 @@
+import hashlib
+import time
+from functools import wraps
+from urllib.parse import urlencode
+from uuid import uuid4
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.http import HttpRequest, HttpResponse
+from django.utils.connection import ConnectionProxy
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.status import HTTP_200_OK, HTTP_304_NOT_MODIFIED
+
+DATASET_VERSION_KEY = "trials:dataset-version"
+# The version is kept in its own cache,
+#   not to be culled with the responses when the default cache is full.
+# If it is culled, every cached response and ETag is changed without a sync.
+version_cache = ConnectionProxy(
+    caches, getattr(settings, "TRIALS_VERSION_CACHE", "default")
+)
+RESPONSE_KEY_PREFIX = "trials:response"
+# The async views cache the rendered content instead of the data.
+CONTENT_KEY_PREFIX = "trials:content"
+# Responses depend on the time(e.g. updated for 7 days),
+# so they are cached at most for this seconds even if the dataset is same.
+RESPONSE_TIMEOUT = getattr(settings, "TRIALS_CACHE_TIMEOUT", 60 * 60)
+
+
+def get_dataset_version() -> str:
+    """
+    Get the version of the trials in DB.
+    If there is no version yet, make one.
+    """
+    version = version_cache.get(DATASET_VERSION_KEY)
+    if version is None:
+        version_cache.add(DATASET_VERSION_KEY, uuid4().hex, timeout=None)
+        version = version_cache.get(DATASET_VERSION_KEY)
+    return version
+
+
+async def aget_dataset_version() -> str:
+    """
+    Async version of get_dataset_version.
+    """
+    version = await version_cache.aget(DATASET_VERSION_KEY)
+    if version is None:
+        await version_cache.aadd(DATASET_VERSION_KEY, uuid4().hex, timeout=None)
+        version = await version_cache.aget(DATASET_VERSION_KEY)
+    return version
+
+
+def bump_dataset_version() -> str:
+    """
+    Change the version of the trials after they are changed,
+        so that every cached response becomes stale.
+    """
+    version = uuid4().hex
+    version_cache.set(DATASET_VERSION_KEY, version, timeout=None)
+    return version
+
+
+def make_response_key(version: str, path: str, params, renderer_format: str) -> str:
+    """
+    Get the key of the response from the dataset version,
+        the path, the sorted query parameters and the rendered format.
+    The links of a response are absolute,
+        so the path of a response includes the scheme and the host.
+    """
+    params = urlencode(sorted(params.lists()), doseq=True)
+    window = int(time.time() // RESPONSE_TIMEOUT)
+    source = ":".join([version, str(window), path, params, renderer_format])
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+def get_response_key(request: Request) -> str:
+    """
+    Get the key of the response of an APIView.
+    """
+    return make_response_key(
+        get_dataset_version(),
+        request.build_absolute_uri(request.path),
+        request.query_params,
+        request.accepted_renderer.format,
+    )
+
+
+def is_not_modified(request: HttpRequest, etag: str) -> bool:
+    """
+    Check that the client already has the response of the ETag.
+    """
+    if_none_match = request.headers.get("If-None-Match", "")
+    return etag in (tag.strip() for tag in if_none_match.split(","))
+
+
+def cache_response(view_method):
+    """
+    Cache the data of successful responses of the view method
+        until the dataset version is changed.
+    The ETag of the response is derived from the key of the cache,
+        and a request with the same `If-None-Match` gets 304 without the body.
+    """
+
+    @wraps(view_method)
+    def wrapper(self, request: Request, *args, **kwargs) -> Response:
+        key = get_response_key(request)
+        etag = f'"{key[:32]}"'
+        if is_not_modified(request, etag):
+            return Response(status=HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        data = cache.get(f"{RESPONSE_KEY_PREFIX}:{key}")
+        if data is not None:
+            response = Response(data)
+        else:
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code != HTTP_200_OK:
+                return response
+            cache.set(f"{RESPONSE_KEY_PREFIX}:{key}", response.data, RESPONSE_TIMEOUT)
+        response["ETag"] = etag
+        return response
+
+    return wrapper
+
+
+def acache_response(view_method):
+    """
+    Async version of cache_response for the async views,
+        which return JSON HttpResponse without content negotiation.
+    """
+
+    @wraps(view_method)
+    async def wrapper(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        version = await aget_dataset_version()
+        key = make_response_key(
+            version, request.build_absolute_uri(request.path), request.GET, "json"
+        )
+        etag = f'"{key[:32]}"'
+        if is_not_modified(request, etag):
+            response = HttpResponse(status=HTTP_304_NOT_MODIFIED)
+            response["ETag"] = etag
+            return response
+        content = await cache.aget(f"{CONTENT_KEY_PREFIX}:{key}")
+        if content is not None:
+            response = HttpResponse(content, content_type="application/json")
+        else:
+            response = await view_method(self, request, *args, **kwargs)
+            if response.status_code != HTTP_200_OK:
+                return response
+            await cache.aset(
+                f"{CONTENT_KEY_PREFIX}:{key}", response.content, RESPONSE_TIMEOUT
+            )
+        response["ETag"] = etag
+        return response
+
+    return wrapper
@@ -1,98 +1,436 @@
-import sys
+import contextlib
+import hashlib
+import json
+from collections import defaultdict
 from pathlib import Path
-from datetime import datetime
-from .utils.requests import get_data, save_data_to_csv
-from .models import Trial
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from .cache import bump_dataset_version
+from .metrics import collect_metrics, count, timed
+from .utils.locks import sync_lock
+from .utils.snapshots import (
+    has_part,
+    new_snapshot_name,
+    prune_snapshots,
+    save_pages,
+)
+from .models import SyncRun, Trial, TrialRevision
+from .pagination import update_table_statistics
+from .periods import annotate_periods
+from .signals import sync_finished
+from .sources import (
+    KEY_COLUMN,
+    TRIAL_MAPPING,
+    get_sources,
+    get_sources_fingerprint,
+    iter_sources,
+)
+from .stats import STAT_FIELDS, add_delta, apply_deltas, get_stat_values, new_deltas
 
 LOG_PATH = Path(__file__).parent.parent / "log"
-verbose_to_field = {
-    "과제명": "name",
-    "과제번호": "number",
-    "연구기간": "period",
-    "연구범위": "scope",
-    "연구종류": "kind",
-    "연구책임기관": "institution",
-    "임상시험단계(연구모형)": "stage",
-    "전체목표연구대상자수": "target",
-    "진료과": "department",
-}
+# The number of trials removed by a query
+REMOVE_BATCH_SIZE = 500
+# The probe covers only the total count and the first data,
+#   so a full sync runs at least once in this time even if the probe is same.
+SYNC_MAX_AGE = timedelta(seconds=getattr(settings, "TRIALS_SYNC_MAX_AGE", 24 * 60 * 60))
+# The cron starts the syncs at the same times every day,
+#   so the last run which started a little less than SYNC_MAX_AGE ago is also old.
+# e.g. The run started at 09:00:05 yesterday is old at 09:00 today.
+SYNC_MAX_AGE_MARGIN = timedelta(hours=1)
 
 
 def log_updated_data():
     """
     Log the updated data.
+    If the last sync is failed, resume it.
+    Then remove the old snapshots by the retention policy.
+    The output is restored even if the sync is failed(e.g. FetchError).
     """
     now = datetime.now()
     log_fn = LOG_PATH / f"{now.strftime('%Y%m%d-%H%M%S')}.log"
-    with open(log_fn, "w") as sys.stdout:
-        update_data()
-    sys.stdout = sys.__stdout__
+    with open(log_fn, "w") as f, contextlib.redirect_stdout(f):
+        update_data(resume=True)
+        with sync_lock() as locked:
+            if locked:
+                removed = prune_snapshots()
+                print(f"Snapshots are pruned: {removed}")
     print(f"Log is saved to {log_fn}.")
 
 
-def update_data():
+def update_data(force=False, resume=False):
     """
-    Update data using get_data.
-    If there is a new data, create a new Trial instance.
-    Else if some data is updated, update the instance.
+    Update data from all the sources using iter_sources.
+    Only one sync runs at a time, and the others are skipped.
+    If `resume` is True and the last sync is not finished,
+        continue it from the page after the checkpoint of each source.
+    If the pages written before its checkpoints are pruned from the snapshot,
+        run a new sync from the first pages instead.
+    Else if the probe of the sources is same with the last successful sync
+        which started within `SYNC_MAX_AGE`(less the margin),
+        skip the sync unless `force` is True.
+    The metrics of the run are saved with it.
     """
-    data = get_data()
-    save_data_to_csv(data)
-    counter = {"created": 0, "fail": 0, "updated": 0}
-    for row in data:
-        trial_info = {verbose_to_field[k]: v for k, v in row.items()}
-        # Convert verbose name to field name
-        if not trial_info.get("target"):
-            # If the target is empty, skip the data
-            # It will make the data null
-            trial_info.pop("target")
-        try:
-            trial, is_created = Trial.objects.get_or_create(
-                number=trial_info.pop("number"),
-                defaults=trial_info,
+    sources = get_sources()
+    with sync_lock() as locked, collect_metrics() as metrics:
+        if not locked:
+            print("Another sync is running.")
+            return
+        run = get_unfinished_run() if resume else None
+        if run is not None and run.checkpoints and not has_part(get_snapshot_name(run)):
+            print("The snapshot of the last sync is pruned, so a new sync runs.")
+            run = None
+            force = True
+        if run is not None:
+            print(f"Resume the sync after the pages {run.checkpoints}.")
+        else:
+            fingerprint = get_sources_fingerprint(sources)
+            last_run = SyncRun.objects.filter(status=SyncRun.Status.SUCCESS).last()
+            fresh_since = timezone.now() - SYNC_MAX_AGE + SYNC_MAX_AGE_MARGIN
+            is_same = (
+                last_run is not None
+                and last_run.fingerprint == fingerprint
+                and last_run.started_at > fresh_since
             )
-            # Get trial instance with number
-        except Exception as e:
-            name = row.get("name")
-            error = str(e)
-            if name:  # If name exists, print the name and error.
-                print(f"{name} got {error}.")
-            else:  # If name does not exist, print data and error.
-                print(f"This data got {error}.")
-                print("\n".join(f"  {key}: {value}" for key, value in row.items()))
-            counter["fail"] += 1
-            continue
-        if is_created:
-            # If the trial is created, print the created trial.
-            print(f"Successfully create {trial}.")
-            counter["created"] += 1
+            if fingerprint and is_same and not force:
+                SyncRun.objects.create(
+                    status=SyncRun.Status.SKIPPED,
+                    fingerprint=fingerprint,
+                    finished_at=timezone.now(),
+                    metrics=metrics.to_dict(),
+                )
+                print("Nothing is changed since the last sync.")
+                return
+            run = SyncRun.objects.create(
+                fingerprint=fingerprint,
+                snapshot=new_snapshot_name(),
+            )
+        run.status = SyncRun.Status.RUNNING
+        try:
+            sync_pages(run, sources)
+        except Exception:
+            run.status = SyncRun.Status.FAILED
+            raise
         else:
-            # If the trial already exists,
-            # check that the data is updated.
-            trial, is_updated = update_if_changed(trial, trial_info)
-            if is_updated:
-                # If the data is updated, print the updated trial.
-                trial.save()
-                print(f"Successfully update {trial}.")
-                counter["updated"] += 1
+            run.status = SyncRun.Status.SUCCESS
+            update_table_statistics(Trial._meta.db_table)
+        finally:
+            run.finished_at = timezone.now()
+            run.metrics = metrics.to_dict()
+            run.save()
+            # Even a failed run may change some trials.
+            bump_dataset_version()
+            sync_finished.send(sender=update_data, run=run)
+            print(f"Metrics: {json.dumps(run.metrics)}")
+
+
+def get_unfinished_run():
+    """
+    Get the last run if it is failed or killed while running.
+    """
+    run = SyncRun.objects.exclude(status=SyncRun.Status.SKIPPED).last()
+    if run is None or run.status == SyncRun.Status.SUCCESS:
+        return None
+    return run
+
+
+def get_snapshot_name(run):
+    """
+    Get the name of the snapshot of the run.
+    The runs before snapshots were stored have csv names.
+    """
+    return run.snapshot.removesuffix(".csv")
+
+
+def sync_pages(run, sources):
+    """
+    The pages of the sources are fetched at the same time,
+        and each page is saved to the snapshot and applied to DB in order of pages,
+        so only a few pages are kept in memory.
+    After each page is applied, the checkpoint of its source is saved.
+    If the run reads all the pages of every source from the first page,
+        the trials which are not in any source anymore are removed.
+    A resumed run does not have the numbers of the pages before its checkpoints,
+        so it reads all the numbers of the sources again to remove the trials.
+    If some data is failed or the trials can not be removed,
+        the fingerprint of the run is cleared so that the next sync is not skipped.
+    """
+    is_full_run = not run.checkpoints
+    pages = save_pages(
+        iter_sources(sources, run.checkpoints), get_snapshot_name(run) or None
+    )
+    counter = {"created": 0, "fail": 0, "updated": 0, "removed": 0}
+    numbers = set()  # The numbers of all the data in the sources
+    sources_with_data = set()
+    for (name, page), data in pages:
+        count("pages")
+        count("rows", len(data))
+        with timed("db"):
+            upsert_batch(data, counter)
+            if is_full_run:
+                numbers.update(row.get(KEY_COLUMN) for row in data)
+                sources_with_data.add(name)
+            run.checkpoints[name] = page
+            run.rows_applied += len(data)
+            run.save(update_fields=["checkpoints", "rows_applied"])
+    if not is_full_run:
+        numbers, sources_with_data = collect_numbers(sources)
+    if len(sources_with_data) == len(sources):
+        with timed("db"):
+            remove_missing(numbers, counter)
+    else:
+        # If a source returns no data, it is more likely an error of API.
+        run.fingerprint = ""
+    if counter["fail"]:
+        # The failed data has to be synced again.
+        run.fingerprint = ""
     summary = summarize_counter(counter)
     print(summary)
 
 
+def collect_numbers(sources):
+    """
+    Read all the pages of the sources only for the numbers.
+    Return the numbers and the names of the sources which have data.
+    """
+    numbers = set()
+    sources_with_data = set()
+    for (name, _), data in iter_sources(sources):
+        numbers.update(row.get(KEY_COLUMN) for row in data)
+        sources_with_data.add(name)
+    return numbers, sources_with_data
+
+
+def to_trial_info(row):
+    """
+    Convert verbose name to field name
+        and the values to the python types of the fields.
+    Raise ValidationError if some value is not valid.
+    """
+    trial_info = {TRIAL_MAPPING[k]: v for k, v in row.items()}
+    if not trial_info.get("target"):
+        # If the target is empty, skip the data
+        # It will make the data null
+        trial_info.pop("target", None)
+    for key, value in trial_info.items():
+        field = Trial._meta.get_field(key)
+        value = field.to_python(value)
+        if value is None and not field.null:
+            raise ValidationError(f"{field.verbose_name} is empty")
+        trial_info[key] = value
+    if not trial_info.get("number"):
+        # The data without the key can not be synced.
+        raise ValidationError(
+            f"{Trial._meta.get_field('number').verbose_name} is empty"
+        )
+    return trial_info
+
+
+def hash_trial_info(trial_info):
+    """
+    Get the stable hash of the normalized data.
+    The order of keys does not change the hash.
+    """
+    normalized = json.dumps(trial_info, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def print_failure(row, error):
+    """
+    Print the data which is failed and its error.
+    """
+    name = row.get("과제명")
+    if name:  # If name exists, print the name and error.
+        print(f"{name} got {error}.")
+    else:  # If name does not exist, print data and error.
+        print(f"This data got {error}.")
+        print("\n".join(f"  {key}: {value}" for key, value in row.items()))
+
+
+def upsert_batch(rows, counter, at=None):
+    """
+    Create or update a batch of data with a constant number of queries.
+    1. Load the hashes of the existing Trial instances of the batch at once.
+    2. Load only the instances whose hash is changed
+        and compare them with the data in memory.
+    3. Create the new ones and update only the changed fields
+        with bulk queries in a transaction,
+        with their revisions and the changes of the statistics.
+    If nothing is changed, nothing is written.
+    The changes are made at `at`, or now as default.
+    A past time is for replaying the snapshots.
+    """
+    trial_infos = {}
+    for row in rows:
+        try:
+            trial_info = to_trial_info(row)
+        except (KeyError, ValidationError) as e:
+            print_failure(row, e)
+            counter["fail"] += 1
+            continue
+        trial_infos[trial_info["number"]] = trial_info
+    if not trial_infos:
+        return
+    written_at = timezone.now()
+    now = at or written_at
+    created = []
+    updated = defaultdict(list)  # changed fields: trials
+    rehashed = []  # Trials which are not changed but have no hash yet
+    revisions = []
+    deltas = new_deltas()  # Changes of the statistics
+    try:
+        with transaction.atomic():
+            old_hashes = dict(
+                Trial.objects.filter(number__in=trial_infos).values_list(
+                    "number", "source_hash"
+                )
+            )
+            source_hashes = {
+                number: hash_trial_info(trial_info)
+                for number, trial_info in trial_infos.items()
+            }
+            # The hash is of the source data, so parse the periods after hashing.
+            annotate_periods(trial_infos.values())
+            changed_numbers = [
+                number
+                for number, old_hash in old_hashes.items()
+                if old_hash != source_hashes[number]
+            ]
+            trials = Trial.objects.in_bulk(changed_numbers, field_name="number")
+            for number, trial_info in trial_infos.items():
+                if number not in old_hashes:
+                    trial = Trial(**trial_info, source_hash=source_hashes[number])
+                    created.append(trial)
+                    add_delta(deltas, get_stat_values(trial), 1)
+                    revisions.append(
+                        TrialRevision(
+                            number=number,
+                            action=TrialRevision.Action.CREATED,
+                            changes=without_number(trial_info),
+                        )
+                    )
+                    continue
+                trial = trials.get(number)
+                if trial is None:
+                    # The hash is same, so the data is not changed.
+                    continue
+                trial.source_hash = source_hashes[number]
+                old_values = get_stat_values(trial)
+                changed_fields = update_if_changed(trial, trial_info)
+                if set(changed_fields) & set(STAT_FIELDS):
+                    add_delta(deltas, old_values, -1)
+                    add_delta(deltas, get_stat_values(trial), 1)
+                if changed_fields:
+                    # bulk_update does not touch auto_now field.
+                    trial.updated_at = now
+                    updated[tuple(changed_fields)].append(trial)
+                    revisions.append(
+                        TrialRevision(
+                            number=number,
+                            action=TrialRevision.Action.UPDATED,
+                            changes={key: trial_info[key] for key in changed_fields},
+                        )
+                    )
+                else:
+                    rehashed.append(trial)
+            Trial.objects.bulk_create(created)
+            for fields, changed_trials in updated.items():
+                Trial.objects.bulk_update(
+                    changed_trials, [*fields, "source_hash", "updated_at"]
+                )
+            Trial.objects.bulk_update(rehashed, ["source_hash"])
+            TrialRevision.objects.bulk_create(revisions)
+            apply_deltas(deltas)
+            if at is not None:
+                set_created_at([trial.number for trial in created], at, written_at)
+    except Exception as e:
+        # If the batch is failed, every data in the batch is not applied.
+        print(f"This batch of {len(trial_infos)} data got {e}.")
+        counter["fail"] += len(trial_infos)
+        return
+    for trial in created:
+        # If the trial is created, print the created trial.
+        print(f"Successfully create {trial}.")
+        counter["created"] += 1
+    for changed_trials in updated.values():
+        for trial in changed_trials:
+            # If the data is updated, print the updated trial.
+            print(f"Successfully update {trial}.")
+            counter["updated"] += 1
+
+
+def without_number(trial_info):
+    """
+    Get the data without the number, which is kept in the revision itself.
+    """
+    return {key: value for key, value in trial_info.items() if key != "number"}
+
+
+def set_created_at(numbers, at, written_at):
+    """
+    Change the time of the trials created and the revisions written
+        since `written_at` to `at`.
+    `auto_now_add` fields are always the current time when created.
+    """
+    Trial.objects.filter(number__in=numbers).update(created_at=at, updated_at=at)
+    TrialRevision.objects.filter(created_at__gte=written_at).update(created_at=at)
+
+
+def remove_missing(numbers, counter):
+    """
+    Remove the trials whose number is not in the numbers.
+    """
+    missing = set(Trial.objects.values_list("number", flat=True)) - numbers
+    remove_trials(missing, counter)
+
+
+def remove_trials(numbers, counter, at=None):
+    """
+    Remove the trials of the numbers,
+        and record their revisions and statistics in the same transaction.
+    The revisions are made at `at`, or now as default.
+    """
+    numbers = list(numbers)
+    for start in range(0, len(numbers), REMOVE_BATCH_SIZE):
+        batch = numbers[start : start + REMOVE_BATCH_SIZE]
+        written_at = timezone.now()
+        with transaction.atomic():
+            trials = Trial.objects.filter(number__in=batch)
+            # Only the existing trials are removed and recorded.
+            batch = list(trials.values_list("number", flat=True))
+            deltas = new_deltas()
+            for values in trials.values(*STAT_FIELDS):
+                add_delta(deltas, values, -1)
+            trials.delete()
+            apply_deltas(deltas)
+            TrialRevision.objects.bulk_create(
+                TrialRevision(number=number, action=TrialRevision.Action.REMOVED)
+                for number in batch
+            )
+            if at is not None:
+                set_created_at([], at, written_at)
+        for number in batch:
+            print(f"Successfully remove {number}.")
+        counter["removed"] += len(batch)
+
+
 def update_if_changed(trial, trial_info):
     """
     Check that the data is updated.
-    If the data is updated, update the instance.
+    If the data is updated, update the instance
+        and return the names of the changed fields.
     """
+    changed_fields = []
     for key, value in trial_info.items():
-        is_updated = False
         if getattr(trial, key) != value:
             # If the data is changed,
             # update the data
             setattr(trial, key, value)
-            # and set is_updated to True.
-            is_updated = True
-    return trial, is_updated
+            # and remember the field.
+            changed_fields.append(key)
+    return changed_fields
 
 
 def summarize_counter(counter):
@@ -101,15 +439,17 @@ def summarize_counter(counter):
     """
     updated = counter["updated"]
     created = counter["created"]
+    removed = counter.get("removed", 0)
     fails = counter["fail"]
     successes = updated + created
     total = successes + fails
-    if total == 0:
+    if total == 0 and removed == 0:
         return "Nothing is updated."
-    percentage = successes / total * 100
+    percentage = successes / total * 100 if total else 100
     summary = (
         f"{created} data is created."
         + f" {updated} data is updated."
+        + f" {removed} data is removed."
         + f" {fails} data is failed."
         + f" {percentage:.2f}% of {total} data is updated or created."
     )
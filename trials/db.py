@@ -0,0 +1,15 @@
+from django.conf import settings
+
+SQLITE_PRAGMAS = getattr(settings, "TRIALS_SQLITE_PRAGMAS", {})
+
+
+def set_sqlite_pragmas(sender, connection, **kwargs):
+    """
+    Set `TRIALS_SQLITE_PRAGMAS` for a new SQLite connection.
+    It is connected to `connection_created`.
+    """
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
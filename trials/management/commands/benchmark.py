@@ -0,0 +1,532 @@
+import contextlib
+import dataclasses
+import itertools
+import multiprocessing
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, connections
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from trials import readmodel, sources
+from trials.cache import bump_dataset_version
+from trials.cron import update_data
+from trials.models import SyncRun, Trial, TrialRevision, TrialStat
+from trials.renderers import ORJSONRenderer
+from trials.serializers import TrialSerializer, TrialValuesSerializer
+from trials.utils import locks, requests, snapshots
+from trials.utils.fakeapi import make_server
+from trials.utils.snapshots import PART_SUFFIX, REF_SUFFIX
+
+
+def measure(func, repeat):
+    """
+    Call the function `repeat` times and return the seconds of each call.
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def list_snapshot_files():
+    """
+    Get the files of the snapshots and their objects.
+    """
+    return [
+        *snapshots.DATA_PATH.glob(f"*{REF_SUFFIX}"),
+        *snapshots.DATA_PATH.glob(f"*{PART_SUFFIX}"),
+        *snapshots.OBJECT_PATH.glob("*"),
+    ]
+
+
+def use_data_path(data_path: Path) -> None:
+    """
+    Keep the snapshots and the sync lock in the directory
+        instead of the data directory of the real syncs.
+    """
+    (data_path / "objects").mkdir(exist_ok=True)
+    snapshots.DATA_PATH = data_path
+    snapshots.OBJECT_PATH = data_path / "objects"
+    locks.SYNC_LOCK_PATH = data_path / "sync.lock"
+
+
+def format_percentiles(durations):
+    """
+    Format p50, p95 and p99 of the durations in milliseconds.
+    """
+    if len(durations) < 2:
+        durations = durations * 2
+    cuts = statistics.quantiles(durations, n=100, method="inclusive")
+    p50, p95, p99 = (cuts[i] * 1000 for i in (49, 94, 98))
+    return f"p50 {p50:.2f}ms, p95 {p95:.2f}ms, p99 {p99:.2f}ms"
+
+
+class Command(BaseCommand):
+    help = "Benchmark trials on a temporary database."
+
+    targets = (
+        "serializer",
+        "list",
+        "detail",
+        "readmodel",
+        "get_data",
+        "update_data",
+        "inittrial",
+        "loadtest",
+    )
+    # The targets syncing with the local API
+    sync_targets = ("get_data", "update_data", "inittrial", "loadtest")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "targets",
+            nargs="*",
+            help=f"What to benchmark in {', '.join(self.targets)}. All as default.",
+        )
+        parser.add_argument(
+            "--rows",
+            type=int,
+            default=10000,
+            help="The number of synthetic trials.",
+        )
+        parser.add_argument(
+            "--page-sizes",
+            type=int,
+            nargs="+",
+            default=[5, 100, 1000],
+        )
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument(
+            "--requests",
+            type=int,
+            dest="request_count",
+            default=500,
+            help="The number of requests to the list and detail endpoints.",
+        )
+        parser.add_argument(
+            "--api-rows",
+            type=int,
+            default=10000,
+            help="The number of trials served by the local API.",
+        )
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0.0,
+            help="The seconds each request to the local API waits.",
+        )
+        parser.add_argument(
+            "--error-rate",
+            type=float,
+            default=0.0,
+            help="The rate of requests to the local API failed with 500.",
+        )
+        parser.add_argument(
+            "--sync-repeat",
+            type=int,
+            default=3,
+            help="The number of syncs for each sync target.",
+        )
+        parser.add_argument(
+            "--readers",
+            type=int,
+            default=4,
+            help="The number of threads requesting the API in loadtest.",
+        )
+
+    def handle(self, *args, **options):
+        targets = options["targets"] or self.targets
+        for target in targets:
+            if target not in self.targets:
+                raise CommandError(f"{target} is not a target of benchmark.")
+        # The sync targets replace the synthetic trials, so they run last.
+        targets = [target for target in self.targets if target in targets]
+        # Never touch the real database, cache, snapshots and API.
+        # The database is a file to be shared by the threads and the processes.
+        tmp_dir = tempfile.TemporaryDirectory()
+        use_data_path(Path(tmp_dir.name))
+        test_name = str(Path(tmp_dir.name) / "benchmark.sqlite3")
+        connection.settings_dict["TEST"]["NAME"] = test_name
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        cache = {
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+            "versions": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "versions",
+            },
+        }
+        server = None
+        try:
+            with override_settings(CACHES=cache, ALLOWED_HOSTS=["testserver"]):
+                if set(targets) & set(self.sync_targets):
+                    server = self.start_api(**options)
+                if set(targets) - set(self.sync_targets):
+                    self.create_trials(options["rows"])
+                for target in targets:
+                    getattr(self, f"bench_{target}")(**options)
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            tmp_dir.cleanup()
+
+    def start_api(self, api_rows, latency, error_rate, **options):
+        """
+        Serve the local API in a thread and sync with it without rate limit.
+        """
+        server = make_server(rows=api_rows, latency=latency, error_rate=error_rate)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host, port = server.server_address[:2]
+        # Only the first source is synced with the local API.
+        source = sources.get_sources()[0]
+        url = f"http://{host}:{port}/"
+        sources.SOURCES = {source.name: dataclasses.replace(source, url=url)}
+        requests.RATE_LIMIT = 0
+        requests.rate_limiters.clear()
+        # The local API does not check the key.
+        os.environ.setdefault("API_KEY", "benchmark")
+        return server
+
+    def create_trials(self, rows):
+        Trial.objects.bulk_create(
+            (
+                Trial(
+                    name=f"임상연구 {i}",
+                    number=f"C{i:07d}",
+                    period="2020-01-01 ~ 2023-12-31",
+                    scope="국내",
+                    kind="관찰연구",
+                    institution=f"기관 {i % 50}",
+                    stage=f"{i % 4}상",
+                    target=i % 1000 or None,
+                    department=f"진료과 {i % 20}",
+                )
+                for i in range(rows)
+            ),
+            batch_size=1000,
+        )
+
+    def bench_serializer(self, page_sizes, repeat, **options):
+        """
+        Compare TrialSerializer + JSONRenderer
+            with TrialValuesSerializer + ORJSONRenderer.
+        """
+        trials = Trial.objects.order_by("-updated_at", "-id")
+        values_serializer = TrialValuesSerializer()
+        self.stdout.write("serializer: page_size, model rows/s, values rows/s, gain")
+        for page_size in page_sizes:
+
+            def render_models():
+                page = list(trials[:page_size])
+                data = TrialSerializer(page, many=True).data
+                return JSONRenderer().render(data)
+
+            def render_values():
+                page = trials.values(*values_serializer.sources)[:page_size]
+                return ORJSONRenderer().render(values_serializer.serialize(page))
+
+            if render_models() != render_values():
+                raise CommandError("The outputs of the serializers are different.")
+            model = page_size * repeat / sum(measure(render_models, repeat))
+            values = page_size * repeat / sum(measure(render_values, repeat))
+            self.stdout.write(
+                f"  {page_size:>9}, {model:>14.0f}, {values:>15.0f}, "
+                f"{values / model:.2f}x"
+            )
+
+    def bench_endpoint(self, name, urls, request_count, **options):
+        """
+        Request the urls in turn with and without the response cache.
+        """
+        client = Client()
+        for cached in (False, True):
+            if cached:
+                # Warm up the cache.
+                for url in urls:
+                    client.get(url)
+            durations = []
+            queries = 0
+            for i in range(request_count):
+                if not cached:
+                    bump_dataset_version()
+                url = urls[i % len(urls)]
+                with CaptureQueriesContext(connection) as context:
+                    start = time.perf_counter()
+                    response = client.get(url)
+                    durations.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    raise CommandError(f"{url} got {response.status_code}.")
+                queries += len(context.captured_queries)
+            label = "cached" if cached else "uncached"
+            self.stdout.write(
+                f"{name} ({label}): {request_count / sum(durations):.0f} requests/s, "
+                f"{format_percentiles(durations)}, "
+                f"{queries / request_count:.1f} queries/request"
+            )
+
+    def bench_list(self, rows, page_sizes, **options):
+        """
+        Get the pages of all trials by limit and offset.
+        """
+        urls = [
+            f"/api/v1/trials/?days=0&limit={page_size}&offset={offset}"
+            for page_size in page_sizes
+            for offset in range(0, rows, max(rows // 10, 1))
+        ]
+        self.bench_endpoint("list", urls, **options)
+
+    def bench_detail(self, rows, **options):
+        """
+        Get random trials by number.
+        """
+        numbers = random.Random(0).sample(range(rows), min(rows, 100))
+        urls = [f"/api/v1/trials/C{i:07d}/" for i in numbers]
+        self.bench_endpoint("detail", urls, **options)
+
+    def bench_readmodel(self, rows, request_count, **options):
+        """
+        Compare the list and detail endpoints served from DB and the read model.
+        Each request has a unique parameter to miss the response cache
+            without changing the dataset version, which rebuilds the read model.
+        """
+        rng = random.Random(0)
+        urls = [
+            *(
+                f"/api/v1/trials/?days=0&limit=20&offset={rng.randrange(rows)}"
+                for _ in range(10)
+            ),
+            *(f"/api/v1/trials/?days=0&department=진료과 {i}" for i in range(10)),
+            *(f"/api/v1/trials/C{rng.randrange(rows):07d}/" for _ in range(20)),
+        ]
+        client = Client()
+        enabled = readmodel.ENABLED
+        try:
+            for in_memory in (False, True):
+                readmodel.ENABLED = in_memory
+                if in_memory:
+                    start = time.perf_counter()
+                    model = readmodel.get_read_model()
+                    self.stdout.write(
+                        f"readmodel: {len(model)} trials are built in "
+                        f"{(time.perf_counter() - start) * 1000:.2f}ms"
+                    )
+                durations = []
+                queries = 0
+                for i in range(request_count):
+                    url = urls[i % len(urls)]
+                    url = f"{url}{'&' if '?' in url else '?'}_={i}"
+                    with CaptureQueriesContext(connection) as context:
+                        start = time.perf_counter()
+                        response = client.get(url)
+                        durations.append(time.perf_counter() - start)
+                    if response.status_code != 200:
+                        raise CommandError(f"{url} got {response.status_code}.")
+                    queries += len(context.captured_queries)
+                label = "memory" if in_memory else "db"
+                self.stdout.write(
+                    f"readmodel ({label}): "
+                    f"{request_count / sum(durations):.0f} requests/s, "
+                    f"{format_percentiles(durations)}, "
+                    f"{queries / request_count:.1f} queries/request"
+                )
+        finally:
+            readmodel.ENABLED = enabled
+
+    def clear_trials(self):
+        for model in (Trial, TrialRevision, TrialStat, SyncRun):
+            model.objects.all().delete()
+
+    def run_sync(self, sync):
+        """
+        Run the sync without its logs and remove its snapshots.
+        Return the metrics of its run.
+        """
+        snapshots = set(list_snapshot_files())
+        with open(os.devnull, "w") as devnull:
+            sync(devnull)
+        for path in set(list_snapshot_files()) - snapshots:
+            path.unlink()
+        run = SyncRun.objects.last()
+        if run.status != SyncRun.Status.SUCCESS:
+            raise CommandError(f"The sync is {run.status}.")
+        return run.metrics
+
+    def write_syncs(self, name, runs):
+        durations = [metrics["elapsed"] for metrics in runs]
+        rows = sum(metrics["rows"] for metrics in runs)
+        retries = sum(metrics["retries"] for metrics in runs)
+        queries = sum(metrics["queries"] for metrics in runs) / len(runs)
+        self.stdout.write(
+            f"{name}: {rows / sum(durations):.0f} rows/s, "
+            f"{format_percentiles(durations)}, "
+            f"{queries:.0f} queries/sync, {retries} retries"
+        )
+
+    def bench_get_data(self, api_rows, sync_repeat, **options):
+        """
+        Get all the data from the local API.
+        """
+
+        def get_data():
+            if len(requests.get_data(sources.get_sources()[0].url)) != api_rows:
+                raise CommandError("Some data is not fetched.")
+
+        durations = measure(get_data, sync_repeat)
+        self.stdout.write(
+            f"get_data: {api_rows * sync_repeat / sum(durations):.0f} rows/s, "
+            f"{format_percentiles(durations)}"
+        )
+
+    def bench_update_data(self, sync_repeat, **options):
+        """
+        Sync with the local API from the empty table,
+            and again without any change.
+        """
+
+        def sync(stdout):
+            with contextlib.redirect_stdout(stdout):
+                update_data(force=True)
+
+        created = []
+        unchanged = []
+        for _ in range(sync_repeat):
+            self.clear_trials()
+            created.append(self.run_sync(sync))
+            unchanged.append(self.run_sync(sync))
+        self.write_syncs("update_data (created)", created)
+        self.write_syncs("update_data (unchanged)", unchanged)
+
+    def bench_inittrial(self, sync_repeat, **options):
+        """
+        Replace all the trials with the data from the local API.
+        """
+
+        def sync(stdout):
+            call_command("inittrial", stdout=stdout)
+
+        runs = []
+        for _ in range(sync_repeat):
+            self.clear_trials()
+            runs.append(self.run_sync(sync))
+        self.write_syncs("inittrial", runs)
+
+    def read_until(self, make_url, readers, is_done, phase=0):
+        """
+        Request `make_url(rng)` by the threads until `is_done(requests)` of each.
+        Each phase has its own seeds, not to repeat the URLs of another phase.
+        Return the durations of the requests and the number of the errors.
+        """
+        durations = []
+        errors = []
+        lock = threading.Lock()
+
+        def read(seed):
+            client = Client()
+            rng = random.Random(seed)
+            local_durations = []
+            local_errors = 0
+            try:
+                while not is_done(len(local_durations)):
+                    url = make_url(rng)
+                    start = time.perf_counter()
+                    try:
+                        ok = client.get(url).status_code == 200
+                    except DatabaseError:
+                        # e.g. database is locked
+                        ok = False
+                    local_durations.append(time.perf_counter() - start)
+                    local_errors += not ok
+            finally:
+                connection.close()
+            with lock:
+                durations.extend(local_durations)
+                errors.append(local_errors)
+
+        threads = [
+            threading.Thread(target=read, args=(phase * readers + i,))
+            for i in range(readers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return durations, sum(errors)
+
+    def write_reads(self, name, durations, errors, seconds):
+        if len(durations) < 2:
+            self.stdout.write(f"{name}: too few requests, {errors} errors")
+            return
+        self.stdout.write(
+            f"{name}: {len(durations) / seconds:.0f} requests/s, "
+            f"{format_percentiles(durations)}, {errors} errors"
+        )
+
+    def bench_loadtest(self, rows, api_rows, readers, request_count, **options):
+        """
+        Compare the latency of the list and detail endpoints
+            while nothing runs and while update_data runs in another process.
+        The pages and the trials are random,
+            and every URL has a unique `_` not to be served from the cache.
+        The trials requested by number exist both before and after the sync,
+            so that every response except errors is 200.
+        """
+        self.clear_trials()
+        self.create_trials(rows)
+        request_ids = itertools.count()
+        shared_rows = min(rows, api_rows)
+
+        def make_url(rng):
+            nonce = next(request_ids)
+            if rng.random() < 0.5:
+                offset = rng.randrange(max(rows // 20, 1)) * 20
+                return f"/api/v1/trials/?days=0&limit=20&offset={offset}&_={nonce}"
+            return f"/api/v1/trials/C{rng.randrange(shared_rows):07d}/?_={nonce}"
+
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            journal_mode = cursor.fetchone()[0]
+        self.stdout.write(f"loadtest: journal_mode={journal_mode}, {readers} readers")
+        per_reader = max(request_count // readers, 1)
+        start = time.perf_counter()
+        durations, errors = self.read_until(
+            make_url, readers, lambda count: count >= per_reader
+        )
+        self.write_reads(
+            "loadtest (idle)", durations, errors, time.perf_counter() - start
+        )
+
+        def sync():
+            with open(os.devnull, "w") as devnull:
+                with contextlib.redirect_stdout(devnull):
+                    update_data(force=True)
+
+        # The sync process must open its own connection.
+        connections.close_all()
+        snapshots = set(list_snapshot_files())
+        process = multiprocessing.get_context("fork").Process(target=sync)
+        start = time.perf_counter()
+        process.start()
+        durations, errors = self.read_until(
+            make_url, readers, lambda count: not process.is_alive(), phase=1
+        )
+        process.join()
+        seconds = time.perf_counter() - start
+        for path in set(list_snapshot_files()) - snapshots:
+            path.unlink()
+        if process.exitcode != 0:
+            raise CommandError("The sync is failed.")
+        self.write_reads("loadtest (sync)", durations, errors, seconds)
+        self.stdout.write(f"loadtest: the sync took {seconds:.2f} seconds")
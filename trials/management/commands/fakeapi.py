@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from trials.utils.fakeapi import make_server
+
+
+class Command(BaseCommand):
+    help = "Serve synthetic trials like API for offline syncs and benchmarks."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8001)
+        parser.add_argument(
+            "--rows",
+            type=int,
+            default=1000,
+            help="The number of synthetic trials.",
+        )
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0.0,
+            help="The seconds each request waits.",
+        )
+        parser.add_argument(
+            "--error-rate",
+            type=float,
+            default=0.0,
+            help="The rate of requests failed with 500.",
+        )
+        parser.add_argument("--seed", type=int, default=None)
+
+    def handle(self, *args, **options):
+        server = make_server(
+            options["host"],
+            options["port"],
+            rows=options["rows"],
+            latency=options["latency"],
+            error_rate=options["error_rate"],
+            seed=options["seed"],
+        )
+        host, port = server.server_address[:2]
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Serving {options['rows']} trials at http://{host}:{port}/"
+            )
+        )
+        self.stdout.write(f"Sync with API_URL=http://{host}:{port}/")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
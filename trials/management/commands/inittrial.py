@@ -1,46 +1,64 @@
+from django.core.exceptions import ValidationError
 from django.core.management.base import BaseCommand
-from trials.models import Trial
-from trials.utils.requests import get_data, save_data_to_csv
+from django.db import transaction
+from django.utils import timezone
+from trials.cache import bump_dataset_version
+from trials.cron import hash_trial_info, to_trial_info, without_number
+from trials.metrics import collect_metrics, count, timed
+from trials.models import SyncRun, Trial, TrialRevision
+from trials.pagination import update_table_statistics
+from trials.signals import sync_finished
+from trials.periods import annotate_periods
+from trials.sources import (
+    TRIAL_MAPPING,
+    get_sources,
+    get_sources_fingerprint,
+    iter_sources,
+)
+from trials.stats import rebuild_stats
+from trials.utils.locks import sync_lock
+from trials.utils.requests import DEFAULT_PER_PAGE
+from trials.utils.snapshots import save_pages
+
+# The fields of a trial compared with the old one for its revision
+REVISION_FIELDS = (*TRIAL_MAPPING.values(), "start_date", "end_date")
 
 
 class Command(BaseCommand):
     help = "Initialize trials."
 
-    verbose_to_field = {
-        "과제명": "name",
-        "과제번호": "number",
-        "연구기간": "period",
-        "연구범위": "scope",
-        "연구종류": "kind",
-        "연구책임기관": "institution",
-        "임상시험단계(연구모형)": "stage",
-        "전체목표연구대상자수": "target",
-        "진료과": "department",
-    }
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=DEFAULT_PER_PAGE,
+            help="The number of trials created by a query.",
+        )
 
     def handle(self, *args, **options):
-        Trial.objects.all().delete()
-        data = get_data()
-        save_data_to_csv(data)
-        counter = {"success": 0, "fail": 0}
-        for row in data:
-            trial_info = {self.verbose_to_field[k]: v for k, v in row.items()}
-            if not trial_info.get("target"):
-                trial_info.pop("target")
+        with sync_lock() as locked, collect_metrics() as metrics:
+            if not locked:
+                self.stdout.write(self.style.ERROR("Another sync is running."))
+                return
+            sources = get_sources()
+            run = SyncRun.objects.create(fingerprint=get_sources_fingerprint(sources))
             try:
-                trial = Trial.objects.create(**trial_info)
-                self.stdout.write(self.style.SUCCESS(f"Successfully create {trial}."))
-                counter["success"] += 1
-            except Exception as e:
-                name = row.get("name")
-                error = self.style.ERROR(str(e))
-                if name:  # If name exists, print the name and error.
-                    self.stdout.write(f"{name} is not created by {error}.")
-                else:  # If name does not exist, print error.
-                    self.stdout.write(f"Some data is not created by {error}.")
-                    for key, value in row.items():
-                        self.stdout.write(f"  {key}: {value}")
-                counter["fail"] += 1
+                counter = self.load(sources, options["batch_size"])
+            except Exception:
+                run.status = SyncRun.Status.FAILED
+                raise
+            else:
+                run.status = SyncRun.Status.SUCCESS
+                if counter["fail"]:
+                    # The failed data has to be synced again by the next sync.
+                    run.fingerprint = ""
+                update_table_statistics(Trial._meta.db_table)
+            finally:
+                run.finished_at = timezone.now()
+                run.metrics = metrics.to_dict()
+                run.save()
+                bump_dataset_version()
+                sync_finished.send(sender=self.__class__, run=run)
         match counter["success"], counter["fail"]:
             case (0, 0):
                 summary = self.style.WARNING("No data is created.")
@@ -57,3 +75,120 @@ class Command(BaseCommand):
                     + f" {percentage:.2f}% of {total} data is created."
                 )
         self.stdout.write(summary)
+
+    def load(self, sources, batch_size):
+        """
+        Replace all the trials with the data from the sources in a transaction.
+        Only the new trials, the changed trials and the removed numbers
+            are recorded as revisions, same as the sync.
+        """
+        pages = save_pages(iter_sources(sources))
+        counter = {"success": 0, "fail": 0}
+        numbers = set()
+        batch = []
+        with transaction.atomic():
+            # Until the transaction is committed,
+            # readers keep seeing the old trials instead of a half-loaded table.
+            old_trials = {
+                values["number"]: values
+                for values in Trial.objects.values(*REVISION_FIELDS).iterator()
+            }
+            Trial.objects.all().delete()
+            for _, data in pages:
+                count("pages")
+                count("rows", len(data))
+                for row in data:
+                    try:
+                        trial_info = to_trial_info(row)
+                        if trial_info["number"] in numbers:
+                            raise ValidationError("duplicated number")
+                    except (KeyError, ValidationError) as e:
+                        self.write_failure(row, e)
+                        counter["fail"] += 1
+                        continue
+                    numbers.add(trial_info["number"])
+                    batch.append(trial_info)
+                    if len(batch) >= batch_size:
+                        with timed("db"):
+                            self.create_batch(batch, old_trials, counter)
+                        batch = []
+            with timed("db"):
+                self.create_batch(batch, old_trials, counter)
+            new_numbers = set(Trial.objects.values_list("number", flat=True))
+            TrialRevision.objects.bulk_create(
+                (
+                    TrialRevision(number=number, action=TrialRevision.Action.REMOVED)
+                    for number in old_trials.keys() - new_numbers
+                ),
+                batch_size=batch_size,
+            )
+            with timed("db"):
+                rebuild_stats()
+        return counter
+
+    def create_batch(self, trial_infos, old_trials, counter):
+        """
+        Create a batch of trials and their revisions with a query for each.
+        A trial which was in `old_trials` is recorded as updated
+            with only its changed fields, or not recorded if it is same.
+        If the batch is failed, only the batch is rolled back.
+        """
+        if not trial_infos:
+            return
+        source_hashes = [hash_trial_info(trial_info) for trial_info in trial_infos]
+        # The hash is of the source data, so parse the periods after hashing.
+        annotate_periods(trial_infos)
+        batch = [
+            Trial(**trial_info, source_hash=source_hash)
+            for trial_info, source_hash in zip(trial_infos, source_hashes)
+        ]
+        revisions = []
+        for trial_info, trial in zip(trial_infos, batch):
+            old = old_trials.get(trial.number)
+            if old is None:
+                revisions.append(
+                    TrialRevision(
+                        number=trial.number,
+                        action=TrialRevision.Action.CREATED,
+                        changes=without_number(trial_info),
+                    )
+                )
+                continue
+            changes = {
+                field: getattr(trial, field)
+                for field in REVISION_FIELDS
+                if getattr(trial, field) != old[field]
+            }
+            if changes:
+                revisions.append(
+                    TrialRevision(
+                        number=trial.number,
+                        action=TrialRevision.Action.UPDATED,
+                        changes=changes,
+                    )
+                )
+        try:
+            with transaction.atomic():
+                Trial.objects.bulk_create(batch)
+                TrialRevision.objects.bulk_create(revisions)
+        except Exception as e:
+            error = self.style.ERROR(str(e))
+            self.stdout.write(f"{len(batch)} data is not created by {error}.")
+            counter["fail"] += len(batch)
+            return
+        for trial in batch:
+            self.stdout.write(self.style.SUCCESS(f"Successfully create {trial}."))
+            counter["success"] += 1
+
+    def write_failure(self, row, e):
+        """
+        Write the data which is not created and its error.
+        """
+        name = row.get("과제명")
+        error = self.style.ERROR(str(e))
+        if name:  # If name exists, print the name and error.
+            self.stdout.write(f"{name} is not created by {error}.")
+        else:  # If name does not exist, print error.
+            self.stdout.write(f"Some data is not created by {error}.")
+            for key, value in row.items():
+                self.stdout.write(f"  {key}: {value}")
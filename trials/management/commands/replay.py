@@ -0,0 +1,176 @@
+import argparse
+import contextlib
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from trials.cache import bump_dataset_version
+from trials.cron import remove_trials, summarize_counter, upsert_batch
+from trials.metrics import collect_metrics, count, timed
+from trials.models import SyncRun, Trial, TrialRevision, TrialStat
+from trials.pagination import update_table_statistics
+from trials.signals import sync_finished
+from trials.sources import KEY_COLUMN
+from trials.utils.locks import sync_lock
+from trials.utils.requests import DEFAULT_PER_PAGE
+from trials.utils.snapshots import diff_snapshots, list_snapshots
+
+NAME_FORMAT = "%Y%m%d-%H%M%S"
+
+
+def get_snapshot_time(path):
+    """
+    Get the time when the snapshot is made from its name.
+    The name is in the local time of the machine.
+    """
+    return datetime.strptime(path.name[:15], NAME_FORMAT).astimezone()
+
+
+def positive_int(value):
+    """
+    The type of the arguments which must be 1 or more.
+    """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"{value} must be 1 or more.")
+    return number
+
+
+class Command(BaseCommand):
+    help = "Rebuild trials by replaying the snapshots in order of time."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--since",
+            default="",
+            help="The first snapshot to replay, e.g. 20230101 or 20230101-090000.",
+        )
+        parser.add_argument(
+            "--until",
+            default="",
+            help="The last snapshot to replay, e.g. 20231231 or 20231231-180000.",
+        )
+        parser.add_argument(
+            "--reset",
+            action="store_true",
+            help="Remove all the trials, revisions and statistics first.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=positive_int,
+            default=os.cpu_count() or 1,
+            help="The number of processes diffing the snapshots.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=positive_int,
+            default=DEFAULT_PER_PAGE,
+            help="The number of trials applied by a batch.",
+        )
+
+    def handle(self, *args, **options):
+        snapshots = self.select_snapshots(options["since"], options["until"])
+        if not snapshots:
+            raise CommandError("There is no snapshot to replay.")
+        with sync_lock() as locked, collect_metrics() as metrics:
+            if not locked:
+                raise CommandError("Another sync is running.")
+            if options["reset"]:
+                with transaction.atomic():
+                    for model in (Trial, TrialRevision, TrialStat):
+                        model.objects.all().delete()
+            try:
+                counter = self.replay(snapshots, **options)
+                update_table_statistics(Trial._meta.db_table)
+            finally:
+                bump_dataset_version()
+            # The replay is recorded as a successful run without a fingerprint,
+            #   so the next sync is neither skipped nor resumed.
+            run = SyncRun.objects.create(
+                status=SyncRun.Status.SUCCESS,
+                snapshot=snapshots[-1].name,
+                finished_at=timezone.now(),
+                metrics=metrics.to_dict(),
+            )
+            sync_finished.send(sender=self.__class__, run=run)
+        self.stdout.write(self.style.SUCCESS(summarize_counter(counter)))
+
+    def select_snapshots(self, since, until):
+        """
+        Get the snapshots whose names are in [since, until].
+        A date includes all the snapshots of the day.
+        """
+        return [
+            path
+            for path in list_snapshots()
+            if path.name >= since and (not until or path.name[: len(until)] <= until)
+        ]
+
+    def iter_diffs(self, snapshots, workers):
+        """
+        Yield the diff of each snapshot from the previous one in order.
+        The snapshots are diffed by the processes at the same time,
+            but at most `workers` diffs are waiting to be applied.
+        """
+        pairs = iter(zip([None, *snapshots], snapshots))
+        # The processes are forked to inherit the settings and the paths,
+        #   instead of spawned(the default on macOS) without them.
+        executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("fork")
+        )
+        with executor:
+            pending = deque(
+                (
+                    current,
+                    executor.submit(diff_snapshots, previous, current, KEY_COLUMN),
+                )
+                for previous, current in islice(pairs, workers)
+            )
+            while pending:
+                current, future = pending.popleft()
+                changed, numbers = future.result()
+                for previous, next_snapshot in islice(pairs, 1):
+                    pending.append(
+                        (
+                            next_snapshot,
+                            executor.submit(
+                                diff_snapshots, previous, next_snapshot, KEY_COLUMN
+                            ),
+                        )
+                    )
+                yield current, changed, numbers
+
+    def replay(self, snapshots, workers, batch_size, verbosity, **options):
+        """
+        Apply the changed data of each snapshot and remove the missing trials
+            at the time of the snapshot.
+        The first snapshot is compared with the trials in DB.
+        """
+        counter = {"created": 0, "fail": 0, "updated": 0, "removed": 0}
+        numbers = set(Trial.objects.values_list("number", flat=True))
+        with open(os.devnull, "w") as devnull:
+            # The logs of each trial are written only with -v 2.
+            log = self.stdout if verbosity > 1 else devnull
+            for snapshot, changed, current in self.iter_diffs(snapshots, workers):
+                if not current:
+                    # If API returned no data, it is more likely an error of API.
+                    self.stdout.write(self.style.WARNING(f"{snapshot.name} is empty."))
+                    continue
+                at = get_snapshot_time(snapshot)
+                count("pages")  # A snapshot is counted as a page.
+                count("rows", len(changed))
+                with contextlib.redirect_stdout(log), timed("db"):
+                    for start in range(0, len(changed), batch_size):
+                        upsert_batch(changed[start : start + batch_size], counter, at)
+                    remove_trials(numbers - current, counter, at)
+                numbers = current
+                if verbosity:
+                    self.stdout.write(
+                        f"{snapshot.name}: {len(changed)} data is new or changed."
+                    )
+        return counter
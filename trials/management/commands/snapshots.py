@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from trials.utils.locks import sync_lock
+from trials.utils.snapshots import (
+    SNAPSHOT_KEEP_DAYS,
+    SNAPSHOT_KEEP_LAST,
+    compact_snapshots,
+    prune_snapshots,
+)
+
+
+class Command(BaseCommand):
+    help = "Compact the legacy csv snapshots and remove the old snapshots."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--keep-last",
+            type=int,
+            default=SNAPSHOT_KEEP_LAST,
+            help="The number of the last snapshots to keep.",
+        )
+        parser.add_argument(
+            "--keep-days",
+            type=int,
+            default=SNAPSHOT_KEEP_DAYS,
+            help="The days to keep the last snapshot of each day"
+            "(default: all the days).",
+        )
+
+    def handle(self, *args, **options):
+        # The snapshot of a running sync is not committed yet.
+        with sync_lock() as locked:
+            if not locked:
+                self.stdout.write(self.style.ERROR("Another sync is running."))
+                return
+            moved = compact_snapshots()
+            removed = prune_snapshots(options["keep_last"], options["keep_days"])
+        self.stdout.write(f"{moved} csv files are compacted.")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{removed['refs']} snapshots, {removed['objects']} objects "
+                f"and {removed['parts']} part files are removed."
+            )
+        )
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from trials.cron import update_data
+
+
+class Command(BaseCommand):
+    help = "Sync trials with API."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Resume the last sync from its checkpoint if it is not finished.",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Sync even if API is not changed since the last sync.",
+        )
+
+    def handle(self, *args, **options):
+        update_data(force=options["force"], resume=options["resume"])
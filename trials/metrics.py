@@ -0,0 +1,209 @@
+import resource
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from django.db import connection
+from django.db.models import Count
+from .models import SyncRun
+
+# The upper bounds(seconds) of the buckets of the request latency
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# The metrics of the last sync exported as gauges
+SYNC_GAUGES = (
+    "elapsed",
+    "pages",
+    "rows",
+    "pages_per_second",
+    "rows_per_second",
+    "retries",
+    "queries",
+    "peak_memory",
+)
+
+
+def get_peak_memory() -> int:
+    """
+    Get the peak resident memory of the process in bytes.
+    `ru_maxrss` is in kilobytes on Linux and in bytes on macOS.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class SyncMetrics:
+    """
+    Metrics of a sync.
+    The durations of the stages in the fetching threads are summed,
+        so a stage can be longer than the whole sync.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def add_time(self, stage: str, seconds: float) -> None:
+        with self.lock:
+            self.stages[stage] += seconds
+
+    def add_count(self, name: str, value: int = 1) -> None:
+        with self.lock:
+            self.counts[name] += value
+
+    def count_query(self, execute, sql, params, many, context):
+        """
+        Count the queries with `connection.execute_wrapper`.
+        """
+        self.add_count("queries")
+        return execute(sql, params, many, context)
+
+    def to_dict(self) -> dict:
+        elapsed = time.perf_counter() - self.started
+        pages = self.counts["pages"]
+        rows = self.counts["rows"]
+        return {
+            "elapsed": round(elapsed, 3),
+            "stages": {stage: round(value, 3) for stage, value in self.stages.items()},
+            "pages": pages,
+            "rows": rows,
+            "pages_per_second": round(pages / elapsed, 3) if elapsed else 0,
+            "rows_per_second": round(rows / elapsed, 3) if elapsed else 0,
+            "retries": self.counts["retries"],
+            "queries": self.counts["queries"],
+            "peak_memory": get_peak_memory(),
+        }
+
+
+# The metrics of the running sync, only one sync runs at a time.
+current: SyncMetrics | None = None
+
+
+@contextmanager
+def collect_metrics():
+    """
+    Collect the metrics of the sync in the block.
+    The queries of this thread are counted.
+    """
+    global current
+    metrics = SyncMetrics()
+    current = metrics
+    try:
+        with connection.execute_wrapper(metrics.count_query):
+            yield metrics
+    finally:
+        current = None
+
+
+@contextmanager
+def timed(stage: str):
+    """
+    Add the duration of the block to the stage of the running sync.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if current is not None:
+            current.add_time(stage, time.perf_counter() - start)
+
+
+def count(name: str, value: int = 1) -> None:
+    """
+    Add the value to the count of the running sync.
+    """
+    if current is not None:
+        current.add_count(name, value)
+
+
+class Histogram:
+    """
+    Thread-safe histogram of the values for each label.
+    It is kept in the memory of a process, so each worker exports its own.
+    Let Prometheus scrape every worker and sum them, e.g. with `sum by (le)`.
+    """
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.values = {}  # label: (bucket counts, sum, count)
+        self.lock = threading.Lock()
+
+    def observe(self, label: str, value: float) -> None:
+        with self.lock:
+            counts, total, number = self.values.get(
+                label, ([0] * len(self.buckets), 0.0, 0)
+            )
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[label] = (counts, total + value, number + 1)
+
+    def render(self, name: str, label_name: str) -> list[str]:
+        """
+        Render the histogram in Prometheus text format.
+        """
+        lines = []
+        with self.lock:
+            values = sorted(self.values.items())
+        for label, (counts, total, number) in values:
+            labels = f'{label_name}="{label}"'
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {bucket_count}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {number}')
+            lines.append(f"{name}_sum{{{labels}}} {total}")
+            lines.append(f"{name}_count{{{labels}}} {number}")
+        return lines
+
+
+# The latency of the requests of the API by view in this process(not shared)
+request_latency = Histogram(LATENCY_BUCKETS)
+
+
+def render_metrics() -> str:
+    """
+    Render the metrics of the last sync, the number of the runs
+        and the request latency in Prometheus text format.
+    """
+    lines = [
+        "# HELP trials_sync_runs_total The number of the sync runs by status.",
+        "# TYPE trials_sync_runs_total counter",
+    ]
+    runs = SyncRun.objects.values("status").annotate(total=Count("id"))
+    for row in runs.order_by("status"):
+        lines.append(
+            f'trials_sync_runs_total{{status="{row["status"]}"}} {row["total"]}'
+        )
+    run = (
+        SyncRun.objects.exclude(status=SyncRun.Status.SKIPPED)
+        .filter(finished_at__isnull=False, metrics__isnull=False)
+        .last()
+    )
+    if run is not None:
+        metrics = run.metrics
+        lines += [
+            "# HELP trials_sync_stage_seconds"
+            " The duration of each stage of the last sync.",
+            "# TYPE trials_sync_stage_seconds gauge",
+        ]
+        for stage, seconds in sorted(metrics["stages"].items()):
+            lines.append(f'trials_sync_stage_seconds{{stage="{stage}"}} {seconds}')
+        for name in SYNC_GAUGES:
+            lines += [
+                f"# TYPE trials_sync_{name} gauge",
+                f"trials_sync_{name} {metrics[name]}",
+            ]
+        finished_at = run.finished_at.timestamp()
+        lines += [
+            "# TYPE trials_sync_last_finished_timestamp_seconds gauge",
+            f"trials_sync_last_finished_timestamp_seconds {finished_at}",
+            "# TYPE trials_sync_last_success gauge",
+            f"trials_sync_last_success {int(run.status == SyncRun.Status.SUCCESS)}",
+        ]
+    lines += [
+        "# HELP trials_request_duration_seconds The latency of the API requests.",
+        "# TYPE trials_request_duration_seconds histogram",
+        *request_latency.render("trials_request_duration_seconds", "view"),
+    ]
+    return "\n".join(lines) + "\n"
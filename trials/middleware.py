@@ -0,0 +1,40 @@
+import asyncio
+import time
+from django.utils.decorators import sync_and_async_middleware
+from .metrics import request_latency
+
+
+def observe(request, seconds):
+    """
+    Observe the latency of a request of the trials API by url name.
+    """
+    match = request.resolver_match
+    if match is not None and "trials" in match.app_names:
+        request_latency.observe(match.url_name, seconds)
+
+
+@sync_and_async_middleware
+def request_latency_middleware(get_response):
+    """
+    Observe the latency of the requests of the trials API.
+    It works with both the sync views and the async views,
+        and Django calls it without a thread for the async views.
+    """
+
+    if asyncio.iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            start = time.perf_counter()
+            response = await get_response(request)
+            observe(request, time.perf_counter() - start)
+            return response
+
+    else:
+
+        def middleware(request):
+            start = time.perf_counter()
+            response = get_response(request)
+            observe(request, time.perf_counter() - start)
+            return response
+
+    return middleware
@@ -0,0 +1,25 @@
+# Generated by Django 4.1.3 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trials", "0002_alter_trial_target"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="trial",
+            name="source_hash",
+            field=models.CharField(
+                blank=True, db_index=True, default="", max_length=64
+            ),
+        ),
+        migrations.AlterField(
+            model_name="trial",
+            name="number",
+            field=models.CharField(max_length=100, unique=True, verbose_name="과제번호"),
+        ),
+    ]
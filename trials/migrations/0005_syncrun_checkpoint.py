@@ -0,0 +1,28 @@
+# Generated by Django 4.1.3 on 2026-10-18 13:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trials", "0004_syncrun"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="syncrun",
+            name="last_page",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="syncrun",
+            name="rows_applied",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="syncrun",
+            name="snapshot",
+            field=models.CharField(blank=True, default="", max_length=100),
+        ),
+    ]
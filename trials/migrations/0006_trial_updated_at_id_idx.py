@@ -0,0 +1,19 @@
+# Generated by Django 4.1.3 on 2026-10-18 13:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trials", "0005_syncrun_checkpoint"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="trial",
+            index=models.Index(
+                fields=["updated_at", "id"], name="trial_updated_at_id_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.1.3 on 2026-10-18 13:10
+
+from django.db import migrations, models
+from trials.search import install_fts, uninstall_fts
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trials", "0006_trial_updated_at_id_idx"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="trial",
+            index=models.Index(fields=["department"], name="trial_department_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="trial",
+            index=models.Index(fields=["institution"], name="trial_institution_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="trial",
+            index=models.Index(fields=["stage"], name="trial_stage_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="trial",
+            index=models.Index(fields=["kind"], name="trial_kind_idx"),
+        ),
+        migrations.RunPython(install_fts, uninstall_fts),
+    ]
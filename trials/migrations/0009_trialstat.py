@@ -0,0 +1,70 @@
+# Generated by Django 4.1.3 on 2026-10-18 13:12
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def build_stats(apps, schema_editor):
+    """
+    Build the statistics of the trials which already exist.
+    """
+    Trial = apps.get_model("trials", "Trial")
+    TrialStat = apps.get_model("trials", "TrialStat")
+    TrialStat.objects.bulk_create(
+        TrialStat(
+            dimension=dimension,
+            value=row[dimension],
+            count=row["count"],
+            target=row["target"] or 0,
+        )
+        for dimension in ("department", "stage", "kind", "institution")
+        for row in Trial.objects.values(dimension)
+        .order_by()
+        .annotate(count=Count("id"), target=Sum("target"))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trials", "0008_trialrevision"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TrialStat",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "dimension",
+                    models.CharField(
+                        choices=[
+                            ("department", "Department"),
+                            ("stage", "Stage"),
+                            ("kind", "Kind"),
+                            ("institution", "Institution"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("value", models.CharField(max_length=100)),
+                ("count", models.IntegerField(default=0)),
+                ("target", models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="trialstat",
+            constraint=models.UniqueConstraint(
+                fields=("dimension", "value"), name="trialstat_dimension_value_unique"
+            ),
+        ),
+        migrations.RunPython(build_stats, migrations.RunPython.noop),
+    ]
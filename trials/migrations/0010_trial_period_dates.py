@@ -0,0 +1,57 @@
+# Generated by Django 4.1.3 on 2026-10-18 13:13
+
+from django.db import migrations, models
+from trials.periods import parse_period
+from trials.search import install_fts
+
+
+def parse_periods(apps, schema_editor):
+    """
+    Parse the periods of the trials which already exist.
+    """
+    Trial = apps.get_model("trials", "Trial")
+    trials = list(Trial.objects.only("period"))
+    for trial in trials:
+        trial.start_date, trial.end_date, trial.period_parse_failed = parse_period(
+            trial.period
+        )
+    Trial.objects.bulk_update(
+        trials, ["start_date", "end_date", "period_parse_failed"], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trials", "0009_trialstat"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="trial",
+            name="end_date",
+            field=models.DateField(null=True, verbose_name="연구종료일"),
+        ),
+        migrations.AddField(
+            model_name="trial",
+            name="period_parse_failed",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="trial",
+            name="start_date",
+            field=models.DateField(null=True, verbose_name="연구시작일"),
+        ),
+        migrations.AddIndex(
+            model_name="trial",
+            index=models.Index(fields=["start_date"], name="trial_start_date_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="trial",
+            index=models.Index(fields=["end_date"], name="trial_end_date_idx"),
+        ),
+        migrations.RunPython(parse_periods, migrations.RunPython.noop),
+        # Adding a field with a default remakes the table on SQLite,
+        # which drops the triggers of the FTS table.
+        migrations.RunPython(install_fts, migrations.RunPython.noop),
+    ]
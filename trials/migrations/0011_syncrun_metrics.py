@@ -0,0 +1,18 @@
+# Generated by Django 4.1.3 on 2026-10-18 13:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trials", "0010_trial_period_dates"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="syncrun",
+            name="metrics",
+            field=models.JSONField(null=True),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.1.3 on 2026-10-18 13:33
+
+from django.db import migrations, models
+
+# The name of the only source before the sources are registered
+LEGACY_SOURCE = "clinical-trials"
+
+
+def copy_last_page(apps, schema_editor):
+    """
+    Keep the checkpoint of the runs to resume them.
+    """
+    SyncRun = apps.get_model("trials", "SyncRun")
+    for run in SyncRun.objects.filter(last_page__gt=0):
+        run.checkpoints = {LEGACY_SOURCE: run.last_page}
+        run.save(update_fields=["checkpoints"])
+
+
+def copy_checkpoint(apps, schema_editor):
+    SyncRun = apps.get_model("trials", "SyncRun")
+    for run in SyncRun.objects.exclude(checkpoints={}):
+        run.last_page = run.checkpoints.get(LEGACY_SOURCE, 0)
+        run.save(update_fields=["last_page"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trials", "0011_syncrun_metrics"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="syncrun",
+            name="checkpoints",
+            field=models.JSONField(default=dict),
+        ),
+        migrations.RunPython(copy_last_page, copy_checkpoint),
+        migrations.RemoveField(
+            model_name="syncrun",
+            name="last_page",
+        ),
+    ]
@@ -1,3 +1,4 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 
 
@@ -36,8 +37,120 @@ class Trial(models.Model):
         null=True,  # Some data does not have this field.
     )
     department = models.CharField(max_length=100, verbose_name="진료과")
+    # Parsed from period
+    start_date = models.DateField(null=True, verbose_name="연구시작일")
+    end_date = models.DateField(null=True, verbose_name="연구종료일")
+    period_parse_failed = models.BooleanField(default=False)
+    source_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        default="",
+        db_index=True,
+        # The hash of the normalized source data to find changes quickly.
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # For the feed of updated trials ordered by (updated_at, id)
+            models.Index(fields=["updated_at", "id"], name="trial_updated_at_id_idx"),
+            # For the filters of trials
+            models.Index(fields=["department"], name="trial_department_idx"),
+            models.Index(fields=["institution"], name="trial_institution_idx"),
+            models.Index(fields=["stage"], name="trial_stage_idx"),
+            models.Index(fields=["kind"], name="trial_kind_idx"),
+            # For the date ranges of trials
+            models.Index(fields=["start_date"], name="trial_start_date_idx"),
+            models.Index(fields=["end_date"], name="trial_end_date_idx"),
+        ]
+
     def __str__(self):
         return f"{self.name} ({self.number})"
+
+
+class TrialStat(models.Model):
+    """
+    The number of trials and the total of their targets
+        for each value of a dimension(field) of trials.
+    It is refreshed by sync with only the changed trials.
+    """
+
+    class Dimension(models.TextChoices):
+        DEPARTMENT = "department"
+        STAGE = "stage"
+        KIND = "kind"
+        INSTITUTION = "institution"
+
+    dimension = models.CharField(max_length=20, choices=Dimension.choices)
+    value = models.CharField(max_length=100)
+    count = models.IntegerField(default=0)
+    target = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["dimension", "value"],
+                name="trialstat_dimension_value_unique",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.dimension}={self.value}: {self.count}"
+
+
+class TrialRevision(models.Model):
+    """
+    A change of a trial made by sync.
+    `changes` has only the changed fields and their new values,
+        or all the fields when the trial is created.
+    """
+
+    class Action(models.TextChoices):
+        CREATED = "created"
+        UPDATED = "updated"
+        REMOVED = "removed"
+
+    number = models.CharField(max_length=100, db_index=True, verbose_name="과제번호")
+    action = models.CharField(max_length=10, choices=Action.choices)
+    changes = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.number} is {self.action} ({self.id})"
+
+
+class SyncRun(models.Model):
+    """
+    A run of syncing trials with API.
+    The fingerprint of the last successful run is compared with a probe
+        to skip the run when API is not changed.
+    A failed run can be resumed from the page after the checkpoint of each source.
+    A replay is recorded as a successful run with an empty fingerprint,
+        so the sync after it runs fully.
+    The metrics of the run are kept for finding regressions.
+    """
+
+    class Status(models.TextChoices):
+        RUNNING = "running"
+        SUCCESS = "success"
+        SKIPPED = "skipped"
+        FAILED = "failed"
+
+    status = models.CharField(
+        max_length=10,
+        choices=Status.choices,
+        default=Status.RUNNING,
+    )
+    fingerprint = models.CharField(max_length=100, blank=True, default="")
+    # The last applied page of each source to resume the run from the next page.
+    checkpoints = models.JSONField(default=dict)
+    rows_applied = models.IntegerField(default=0)
+    snapshot = models.CharField(max_length=100, blank=True, default="")
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True)
+    # Durations of the stages, throughput, retries, queries and peak memory
+    metrics = models.JSONField(null=True)
+
+    def __str__(self):
+        return f"{self.started_at} ({self.status})"
@@ -0,0 +1,229 @@
+from functools import cached_property, partial
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db import DatabaseError, connection
+from django.db.models import QuerySet
+from rest_framework.pagination import LimitOffsetPagination, PageNumberPagination
+from rest_framework.request import Request
+from rest_framework.utils.urls import replace_query_param
+from .cache import RESPONSE_TIMEOUT, get_dataset_version, make_response_key
+
+# How to count the trials of a list
+#   exact: COUNT(*) for every request
+#   cached: COUNT(*) once for each dataset version and filters
+#   estimated: the statistics of the table without filters, cached like `cached`
+#   none: no count, but one more row is fetched to know the next page
+STRATEGIES = ("exact", "cached", "estimated", "none")
+COUNT_STRATEGIES = {
+    "limit": "exact",
+    "page": "exact",
+    **getattr(settings, "TRIALS_COUNT_STRATEGIES", {}),
+}
+for mode, strategy in COUNT_STRATEGIES.items():
+    if strategy not in STRATEGIES:
+        raise ImproperlyConfigured(
+            f"The count strategy of {mode} must be one of {', '.join(STRATEGIES)}."
+        )
+COUNT_KEY_PREFIX = "trials:count"
+# The parameters which do not change the count
+PAGINATION_PARAMS = ("pagination", "limit", "offset", "page", "page_size", "order")
+
+
+def get_count_key(request: Request, strategy: str) -> str:
+    """
+    Get the key of the count from the dataset version,
+        the path and the query parameters except pagination.
+    """
+    params = request.query_params.copy()
+    for param in PAGINATION_PARAMS:
+        params.pop(param, None)
+    return make_response_key(get_dataset_version(), request.path, params, strategy)
+
+
+def estimate_table_rows(table: str) -> int | None:
+    """
+    Get the number of rows of the table from the statistics of DB.
+    Return None if there are no statistics.
+    """
+    with connection.cursor() as cursor:
+        try:
+            if connection.vendor == "sqlite":
+                # `ANALYZE` writes the number of rows first.
+                cursor.execute(
+                    "SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table]
+                )
+                row = cursor.fetchone()
+                return int(row[0].split()[0]) if row else None
+            if connection.vendor == "postgresql":
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [table]
+                )
+                row = cursor.fetchone()
+                return row[0] if row and row[0] >= 0 else None
+        except DatabaseError:
+            # sqlite_stat1 does not exist before the first `ANALYZE`.
+            return None
+    return None
+
+
+def estimate_count(queryset: QuerySet) -> int:
+    """
+    Estimate the count of all the rows from the statistics of the table.
+    The filtered queryset can not be estimated, so it is counted.
+    """
+    if not queryset.query.where:
+        estimate = estimate_table_rows(queryset.model._meta.db_table)
+        if estimate is not None:
+            return estimate
+    return queryset.count()
+
+
+def count_queryset(queryset: QuerySet, strategy: str, request: Request) -> int:
+    """
+    Count the queryset by the strategy.
+    The cached and estimated counts are kept until the dataset version is changed.
+    """
+    if strategy == "exact":
+        return queryset.count()
+    key = f"{COUNT_KEY_PREFIX}:{get_count_key(request, strategy)}"
+    count = cache.get(key)
+    if count is None:
+        count = (
+            estimate_count(queryset) if strategy == "estimated" else queryset.count()
+        )
+        cache.set(key, count, RESPONSE_TIMEOUT)
+    return count
+
+
+def update_table_statistics(table: str) -> None:
+    """
+    Update the statistics of the table after it is changed,
+        which are used to estimate the count and plan queries.
+    """
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE "{table}"')
+
+
+class LimitOffsetCountPagination(LimitOffsetPagination):
+    """
+    LimitOffsetPagination with a count strategy.
+    Without the count, `count` is null.
+    """
+
+    count_strategy = COUNT_STRATEGIES["limit"]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        if self.count_strategy != "none":
+            return super().paginate_queryset(queryset, request, view)
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+        self.offset = self.get_offset(request)
+        self.count = None
+        rows = list(queryset[self.offset : self.offset + self.limit + 1])
+        self.has_next = len(rows) > self.limit
+        return rows[: self.limit]
+
+    def get_count(self, queryset):
+        return count_queryset(queryset, self.count_strategy, self.request)
+
+    def get_next_link(self):
+        if self.count is not None:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        offset = self.offset + self.limit
+        return replace_query_param(url, self.offset_query_param, offset)
+
+
+class SequencePagination(LimitOffsetCountPagination):
+    """
+    LimitOffsetCountPagination of a sequence in memory(e.g. the read model).
+    The count is always exact because it is the length of the sequence.
+    """
+
+    def get_count(self, queryset):
+        return len(queryset)
+
+
+class CountPaginator(Paginator):
+    """
+    Django paginator which counts the objects with a function.
+    """
+
+    def __init__(self, object_list, per_page, count_object_list, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_object_list = count_object_list
+
+    @cached_property
+    def count(self):
+        return self.count_object_list(self.object_list)
+
+
+class ProbePage(Page):
+    def __init__(self, object_list, number, paginator, has_next):
+        super().__init__(object_list, number, paginator)
+        self.has_next_page = has_next
+
+    def has_next(self):
+        return self.has_next_page
+
+    def next_page_number(self):
+        return self.number + 1
+
+
+class ProbePaginator(Paginator):
+    """
+    Django paginator which does not count the objects.
+    A page gets one more object to know that there is the next page,
+        and the number of pages is known only up to the next page.
+    """
+
+    count = None
+    num_pages = 1
+
+    def validate_number(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger("That page number is not an integer")
+        if number < 1:
+            raise EmptyPage("That page number is less than 1")
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom : bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage("That page contains no results")
+        has_next = len(rows) > self.per_page
+        self.num_pages = number + 1 if has_next else number
+        return ProbePage(rows[: self.per_page], number, self, has_next)
+
+
+class PageNumberCountPagination(PageNumberPagination):
+    """
+    PageNumberPagination with a count strategy.
+    Without the count, `count` is null.
+    """
+
+    count_strategy = COUNT_STRATEGIES["page"]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.count_strategy == "none":
+            self.django_paginator_class = ProbePaginator
+        else:
+            self.django_paginator_class = partial(
+                CountPaginator,
+                count_object_list=partial(
+                    count_queryset, strategy=self.count_strategy, request=request
+                ),
+            )
+        return super().paginate_queryset(queryset, request, view)
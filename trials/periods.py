@@ -0,0 +1,58 @@
+"""
+Parse `연구기간` of trials into the start date and the end date.
+e.g. "2020-01-01 ~ 2022-12-31", "2020.01.01~2022.12.31",
+    "2020년 1월 1일 ~ 2022년 12월 31일", "2020-01 ~ 2022-12"
+A month without a day starts from its first day and ends at its last day.
+"""
+import calendar
+import re
+from collections.abc import Iterable
+from datetime import date
+from functools import lru_cache
+
+# Compiled once and used for every period
+DATE_PATTERN = re.compile(
+    r"(?P<year>\d{4})\s*[-./년]\s*(?P<month>\d{1,2})"
+    r"(?:\s*[-./월]\s*(?P<day>\d{1,2}))?"
+)
+
+
+def to_date(match: re.Match, is_end: bool) -> date:
+    year, month = int(match["year"]), int(match["month"])
+    if match["day"]:
+        return date(year, month, int(match["day"]))
+    day = calendar.monthrange(year, month)[1] if is_end else 1
+    return date(year, month, day)
+
+
+@lru_cache(maxsize=4096)
+def parse_period(period: str) -> tuple[date | None, date | None, bool]:
+    """
+    Parse a period to `(start_date, end_date, is_failed)`.
+    Many trials have the same period, so the results are cached.
+    """
+    matches = list(DATE_PATTERN.finditer(period or ""))
+    if len(matches) != 2:
+        return None, None, True
+    try:
+        start_date = to_date(matches[0], is_end=False)
+        end_date = to_date(matches[1], is_end=True)
+    except ValueError:  # e.g. 2020-13-01
+        return None, None, True
+    if start_date > end_date:
+        return None, None, True
+    return start_date, end_date, False
+
+
+def annotate_periods(trial_infos: Iterable[dict]) -> None:
+    """
+    Add `start_date`, `end_date` and `period_parse_failed`
+        to a batch of data which has `period`.
+    """
+    for trial_info in trial_infos:
+        if "period" not in trial_info:
+            continue
+        start_date, end_date, is_failed = parse_period(trial_info["period"])
+        trial_info["start_date"] = start_date
+        trial_info["end_date"] = end_date
+        trial_info["period_parse_failed"] = is_failed
@@ -0,0 +1,201 @@
+"""
+In-memory read model of the trials.
+The trials are small and change only by the syncs,
+    so each worker keeps all of them in memory with the indexes for the API,
+    and the list, detail and lookup are served without DB.
+A read model is immutable, and a new one is built and swapped in
+    when the dataset version is changed(copy-on-write),
+    so a request always reads one consistent version.
+"""
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from collections.abc import Sequence
+from datetime import timedelta
+from operator import attrgetter
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from .cache import aget_dataset_version, get_dataset_version
+from .models import Trial
+from .serializers import TrialValuesSerializer
+
+ENABLED = getattr(settings, "TRIALS_READ_MODEL", False)
+# The fields of a record, which are the sources of the serializer.
+FIELDS = tuple(TrialValuesSerializer().sources)
+# The filters which have hash indexes
+INDEX_FIELDS = ("department", "institution", "stage")
+# The number of trials read from DB at once while building
+BUILD_CHUNK_SIZE = 2000
+UPDATED_KEY = attrgetter("updated_at", "id")
+
+
+class TrialRecord:
+    """
+    A trial in memory, which is a row of the serializer.
+    """
+
+    __slots__ = FIELDS
+
+    def __init__(self, *values):
+        for field, value in zip(FIELDS, values):
+            setattr(self, field, value)
+
+    def __getitem__(self, field):
+        return getattr(self, field)
+
+
+class Descending(Sequence):
+    """
+    Reversed view of a list without copying it.
+    """
+
+    __slots__ = ("items",)
+
+    def __init__(self, items: list):
+        self.items = items
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        size = len(self.items)
+        if isinstance(index, slice):
+            start, stop, _ = index.indices(size)
+            if stop <= start:
+                return []
+            return self.items[size - stop : size - start][::-1]
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("index out of range")
+        return self.items[size - 1 - index]
+
+
+class ReadModel:
+    """
+    All the trials of a dataset version with the indexes.
+    `by_updated_at` and the lists of the hash indexes are ordered by
+        (updated_at, id), and `by_id` is ordered by id.
+    """
+
+    def __init__(self, version: str, records: list[TrialRecord]):
+        self.version = version
+        self.by_updated_at = sorted(records, key=UPDATED_KEY)
+        self.by_id = sorted(records, key=attrgetter("id"))
+        self.by_number = {record.number: record for record in records}
+        self.indexes = {field: defaultdict(list) for field in INDEX_FIELDS}
+        for record in self.by_updated_at:
+            for field, index in self.indexes.items():
+                index[getattr(record, field)].append(record)
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def get(self, number: str) -> TrialRecord | None:
+        return self.by_number.get(number)
+
+    def find(
+        self, order: str, days: int, filters: dict[str, str]
+    ) -> Sequence[TrialRecord]:
+        """
+        Find the trials of the list in the order, same as `views.get_trials`.
+        The smallest list of the hash indexes of the filters is scanned,
+            and the trials updated for the days are found by bisection.
+        """
+        indexed = [item for item in filters.items() if item[0] in INDEX_FIELDS]
+        if indexed:
+            records = min(
+                (self.indexes[field].get(value, []) for field, value in indexed),
+                key=len,
+            )
+        else:
+            records = self.by_updated_at
+        if days:
+            since = timezone.now() - timedelta(days=days)
+            records = records[
+                bisect_left(records, since, key=attrgetter("updated_at")) :
+            ]
+        if len(indexed) > 1 or len(filters) > len(indexed):
+            # attrgetter of the fields compares all the values at once.
+            get_values = attrgetter(*filters)
+            values = tuple(filters.values())
+            if len(values) == 1:
+                values = values[0]
+            records = [record for record in records if get_values(record) == values]
+        if not order.endswith("updated_at"):
+            if records is self.by_updated_at:
+                records = self.by_id
+            else:
+                records = sorted(records, key=attrgetter("id"))
+        return Descending(records) if order.startswith("-") else records
+
+
+def build_read_model(version: str) -> ReadModel:
+    """
+    Read all the trials from DB into a new read model.
+    """
+    rows = Trial.objects.values_list(*FIELDS).iterator(chunk_size=BUILD_CHUNK_SIZE)
+    return ReadModel(version, [TrialRecord(*row) for row in rows])
+
+
+current: ReadModel | None = None
+# Only one thread of a worker builds a read model at a time.
+build_lock = threading.Lock()
+
+
+def rebuild_read_model(version: str) -> ReadModel:
+    """
+    Build the read model of the version, unless it is already built,
+        and swap it in.
+    """
+    global current
+    with build_lock:
+        if current is None or current.version != version:
+            current = build_read_model(version)
+        return current
+
+
+def get_read_model() -> ReadModel | None:
+    """
+    Get the read model of the current dataset version.
+    If it is stale, rebuild it.
+    Return None if it is off or another thread is building it,
+        then the trials are read from DB not to serve a stale version.
+    """
+    if not ENABLED:
+        return None
+    version = get_dataset_version()
+    model = current
+    if model is not None and model.version == version:
+        return model
+    if build_lock.locked():
+        return None
+    return rebuild_read_model(version)
+
+
+async def aget_read_model() -> ReadModel | None:
+    """
+    Async version of get_read_model.
+    Only the rebuild runs in a thread.
+    """
+    if not ENABLED:
+        return None
+    version = await aget_dataset_version()
+    model = current
+    if model is not None and model.version == version:
+        return model
+    if build_lock.locked():
+        return None
+    return await sync_to_async(rebuild_read_model)(version)
+
+
+def refresh_read_model(sender, **kwargs) -> None:
+    """
+    Rebuild the read model when a sync is finished in this process.
+    It is connected to `sync_finished`.
+    A process which has not served the read model does not build it,
+        and the other processes rebuild it when they find the new version.
+    """
+    if current is not None:
+        rebuild_read_model(get_dataset_version())
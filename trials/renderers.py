@@ -0,0 +1,101 @@
+import csv
+import io
+import zlib
+from collections.abc import Iterable, Iterator
+from itertools import islice
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # orjson is optional.
+    orjson = None
+
+# The number of rows in a chunk of a stream
+STREAM_CHUNK_ROWS = 500
+ORJSON_OPTIONS = (
+    orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME if orjson else 0
+)
+
+
+def dumps(data) -> bytes:
+    """
+    Dump data to JSON bytes, same as `JSONRenderer` with the default settings.
+    Use orjson if it is installed.
+    """
+    if orjson is None:
+        return JSONRenderer().render(data)
+    ret = orjson.dumps(
+        data,
+        default=JSONRenderer.encoder_class().default,
+        option=ORJSON_OPTIONS,
+    )
+    # Same as JSONRenderer, escape U+2028 and U+2029.
+    ret = ret.replace("\u2028".encode(), b"\\u2028")
+    return ret.replace("\u2029".encode(), b"\\u2029")
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    Faster JSONRenderer which uses orjson for compact unicode JSON.
+    The output is same as JSONRenderer.
+    If orjson is not installed, or the output has to be indented,
+        it works as JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if (
+            orjson is None
+            or indent is not None
+            or self.ensure_ascii
+            or not self.compact
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
+
+
+def iter_chunks(rows: Iterable[dict]) -> Iterator[list[dict]]:
+    """
+    Group the rows by `STREAM_CHUNK_ROWS`.
+    """
+    rows = iter(rows)
+    while chunk := list(islice(rows, STREAM_CHUNK_ROWS)):
+        yield chunk
+
+
+def iter_ndjson(rows: Iterable[dict]) -> Iterator[bytes]:
+    """
+    Render the rows to NDJSON, a JSON object per line.
+    """
+    for chunk in iter_chunks(rows):
+        yield b"".join(dumps(row) + b"\n" for row in chunk)
+
+
+def iter_csv(rows: Iterable[dict], fieldnames: list[str]) -> Iterator[bytes]:
+    """
+    Render the rows to CSV with a header of the fieldnames.
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames)
+    writer.writeheader()
+    for chunk in iter_chunks(rows):
+        writer.writerows(chunk)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # There is no row, so only the header is left.
+        yield buffer.getvalue().encode("utf-8")
+
+
+def iter_gzip(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Compress the chunks to a gzip stream.
+    Each chunk is flushed so that the client can decompress it as it arrives.
+    """
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
@@ -0,0 +1,100 @@
+"""
+Full-text search of trials with SQLite FTS5.
+The FTS table indexes `name` and `institution` of trials
+    with the trigram tokenizer, so a keyword matches any part of them.
+Triggers keep it in step with every insert, update and delete of trials,
+    including the bulk queries of the sync.
+"""
+import sqlite3
+from django.db import connection
+from django.db.models import Q, QuerySet
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = "trials_trial_fts"
+# The trigram tokenizer can not match a keyword shorter than this.
+MIN_FTS_KEYWORD_LENGTH = 3
+FTS_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, institution,
+        content='trials_trial', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert
+    AFTER INSERT ON trials_trial BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, institution)
+        VALUES (new.id, new.name, new.institution);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete
+    AFTER DELETE ON trials_trial BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, institution)
+        VALUES ('delete', old.id, old.name, old.institution);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update
+    AFTER UPDATE OF name, institution ON trials_trial BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, institution)
+        VALUES ('delete', old.id, old.name, old.institution);
+        INSERT INTO {FTS_TABLE}(rowid, name, institution)
+        VALUES (new.id, new.name, new.institution);
+    END
+    """,
+    # Index the trials which already exist.
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+DROP_FTS_SQL = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_insert",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_delete",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_update",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+
+def supports_fts(vendor: str) -> bool:
+    """
+    Check that the database supports FTS5 with the trigram tokenizer.
+    """
+    return vendor == "sqlite" and sqlite3.sqlite_version_info >= (3, 34)
+
+
+def install_fts(apps, schema_editor):
+    """
+    Create the FTS table and its triggers.
+    Migrations which remake `trials_trial` on SQLite drop the triggers,
+        so they have to run this again.
+    """
+    if not supports_fts(schema_editor.connection.vendor):
+        return
+    for sql in FTS_SQL:
+        schema_editor.execute(sql)
+
+
+def uninstall_fts(apps, schema_editor):
+    if not supports_fts(schema_editor.connection.vendor):
+        return
+    for sql in DROP_FTS_SQL:
+        schema_editor.execute(sql)
+
+
+def search_trials(trials: QuerySet, keyword: str) -> QuerySet:
+    """
+    Filter trials whose name or institution contains the keyword.
+    Use the FTS table if it can be used, or `icontains` if not.
+    """
+    keyword = keyword.strip()
+    if len(keyword) < MIN_FTS_KEYWORD_LENGTH or not supports_fts(connection.vendor):
+        return trials.filter(
+            Q(name__icontains=keyword) | Q(institution__icontains=keyword)
+        )
+    # Quote the keyword as a phrase so that its characters are not operators.
+    phrase = '"' + keyword.replace('"', '""') + '"'
+    return trials.filter(
+        id__in=RawSQL(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s",
+            [phrase],
+        )
+    )
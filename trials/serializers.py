@@ -1,8 +1,53 @@
 from rest_framework import serializers
-from .models import Trial
+from .models import Trial, TrialRevision
 
 
 class TrialSerializer(serializers.ModelSerializer):
     class Meta:
         model = Trial
+        exclude = ("source_hash",)
+
+
+class TrialRevisionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = TrialRevision
         fields = "__all__"
+
+
+class TrialValuesSerializer:
+    """
+    Read-only serializer for the rows of `Trial.objects.values()`.
+    It maps the rows straight to the output without model instances,
+        and finds how to convert each field once, not for each row.
+    The output is same as TrialSerializer.
+    """
+
+    # The values of these fields are already same as their representation.
+    passthrough_fields = (serializers.CharField, serializers.IntegerField)
+
+    def __init__(self):
+        fields = TrialSerializer().fields.values()
+        self.fields = [
+            (
+                field.field_name,
+                field.source,
+                None
+                if isinstance(field, self.passthrough_fields)
+                else field.to_representation,
+            )
+            for field in fields
+        ]
+        self.field_names = [name for name, _, _ in self.fields]
+        self.sources = [source for _, source, _ in self.fields]
+
+    def to_representation(self, row: dict) -> dict:
+        data = {}
+        for name, source, to_representation in self.fields:
+            value = row[source]
+            if value is not None and to_representation is not None:
+                value = to_representation(value)
+            data[name] = value
+        return data
+
+    def serialize(self, rows) -> list[dict]:
+        return [self.to_representation(row) for row in rows]
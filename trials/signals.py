@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Sent after a sync(update_data, inittrial or replay) changes the trials
+#   and the dataset version is bumped, with `run`(SyncRun).
+sync_finished = Signal()
@@ -0,0 +1,189 @@
+import hashlib
+import queue
+import threading
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from .utils.requests import CONCURRENCY, Row, get_fingerprint, iter_pages
+
+# The columns of the trials(the verbose names of the fields) and their fields.
+# Every source is converted to these columns,
+#   so the snapshots and the sync do not depend on the source.
+TRIAL_MAPPING = {
+    "과제명": "name",
+    "과제번호": "number",
+    "연구기간": "period",
+    "연구범위": "scope",
+    "연구종류": "kind",
+    "연구책임기관": "institution",
+    "임상시험단계(연구모형)": "stage",
+    "전체목표연구대상자수": "target",
+    "진료과": "department",
+}
+KEY_COLUMN = "과제번호"
+FIELD_COLUMNS = {field: column for column, field in TRIAL_MAPPING.items()}
+# A page of a source: ((source name, page), data)
+SourcePage = tuple[tuple[str, int], list[Row]]
+
+
+@dataclass(frozen=True)
+class Source:
+    """
+    A dataset of API synced into the trials.
+    `mapping` maps the columns of API to the fields of the trials,
+        and the columns which are not mapped are ignored.
+    Every source must map a column to `number`, which identifies a trial.
+    """
+
+    name: str
+    url: str
+    mapping: dict[str, str] = field(default_factory=lambda: dict(TRIAL_MAPPING))
+
+    def validate(self) -> None:
+        """
+        Raise ImproperlyConfigured if the source can not be synced.
+        """
+        unknown = set(self.mapping.values()) - set(FIELD_COLUMNS)
+        if unknown:
+            raise ImproperlyConfigured(
+                f"Source {self.name} maps to unknown fields: "
+                f"{', '.join(sorted(unknown))}."
+            )
+        if TRIAL_MAPPING[KEY_COLUMN] not in self.mapping.values():
+            raise ImproperlyConfigured(
+                f"Source {self.name} must map a column to "
+                f"{TRIAL_MAPPING[KEY_COLUMN]}."
+            )
+
+    def to_row(self, row: Row) -> Row:
+        """
+        Convert a data of API to the columns of the trials.
+        Only the mapped columns which the data has are converted,
+            so the fields which the source does not have are not changed by it.
+        The data without the key fails in the sync.
+        """
+        return {
+            FIELD_COLUMNS[field]: row[column]
+            for column, field in self.mapping.items()
+            if column in row
+        }
+
+
+def load_sources(config: dict[str, dict]) -> dict[str, Source]:
+    """
+    Make the sources from `TRIALS_SOURCES` and validate them.
+    """
+    if not config:
+        raise ImproperlyConfigured("TRIALS_SOURCES must have a source.")
+    sources = {}
+    for name, options in config.items():
+        try:
+            source = Source(name=name, **options)
+        except TypeError as e:
+            raise ImproperlyConfigured(f"Source {name} is not valid: {e}")
+        source.validate()
+        sources[name] = source
+    return sources
+
+
+SOURCES = load_sources(getattr(settings, "TRIALS_SOURCES", {}))
+
+
+def get_sources() -> list[Source]:
+    """
+    Get the registered sources in order of the settings.
+    """
+    return list(SOURCES.values())
+
+
+def get_sources_fingerprint(sources: list[Source]) -> str:
+    """
+    Get the fingerprint of the sources by probing them at the same time.
+    A single source has its own fingerprint, same as before the registry.
+    If every source returns no data, return an empty string.
+    """
+    with ThreadPoolExecutor(max_workers=len(sources)) as executor:
+        fingerprints = list(
+            executor.map(lambda source: get_fingerprint(source.url), sources)
+        )
+    if len(sources) == 1:
+        return fingerprints[0]
+    if not any(fingerprints):
+        return ""
+    joined = ";".join(
+        f"{source.name}={fingerprint}"
+        for source, fingerprint in zip(sources, fingerprints)
+    )
+    return hashlib.sha256(joined.encode("utf-8")).hexdigest()
+
+
+def iter_sources(
+    sources: Iterable[Source],
+    checkpoints: dict[str, int] | None = None,
+    concurrency: int = CONCURRENCY,
+) -> Iterator[SourcePage]:
+    """
+    Yield `((source name, page), data)` of all the sources,
+        from the page after the checkpoint of each source.
+    Each source is fetched by its own thread at the same time,
+        so all the sources take about as long as the slowest one.
+    The pages are yielded in order of the page number,
+        and the pages of the same number in order of the sources,
+        so the snapshot of the same data is same whichever source is faster,
+        and a resumed run continues in the same order.
+    The data is converted to the columns of the trials.
+    At most `concurrency` pages of each source are waiting to be yielded.
+    If a source is failed, the others are stopped and the error is raised.
+    """
+    sources = list(sources)
+    checkpoints = dict(checkpoints or {})
+    queues = [queue.Queue(maxsize=max(concurrency, 1)) for _ in sources]
+    stopped = threading.Event()
+
+    def put(pages: queue.Queue, item) -> bool:
+        # Give up when the consumer is stopped, not to block forever.
+        while not stopped.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def fetch(source: Source, pages: queue.Queue) -> None:
+        try:
+            start_page = checkpoints.get(source.name, 0) + 1
+            for page, data in iter_pages(source.url, start_page, concurrency):
+                if not put(pages, (page, [source.to_row(row) for row in data])):
+                    return
+        except Exception as e:
+            put(pages, (None, e))
+        else:
+            put(pages, (None, None))
+
+    with ThreadPoolExecutor(max_workers=max(len(sources), 1)) as executor:
+        for source, pages in zip(sources, queues):
+            executor.submit(fetch, source, pages)
+        try:
+            # The next page of each running source by its index
+            heads = {}
+            running = set(range(len(sources)))
+            while running:
+                for index in running - heads.keys():
+                    heads[index] = queues[index].get()
+                for index in sorted(running):
+                    page, data = heads[index]
+                    if page is None:
+                        # The source is finished or failed.
+                        if isinstance(data, Exception):
+                            raise data
+                        running.remove(index)
+                        del heads[index]
+                if running:
+                    index = min(running, key=lambda index: (heads[index][0], index))
+                    page, data = heads.pop(index)
+                    yield (sources[index].name, page), data
+        finally:
+            stopped.set()
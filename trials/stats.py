@@ -0,0 +1,84 @@
+from collections import defaultdict
+from django.db.models import Count, Q, Sum
+from .models import Trial, TrialStat
+
+DIMENSIONS = TrialStat.Dimension.values
+# The fields which change the statistics
+STAT_FIELDS = (*DIMENSIONS, "target")
+
+
+def new_deltas():
+    """
+    Make the changes of statistics.
+    {(dimension, value): [count, target]}
+    """
+    return defaultdict(lambda: [0, 0])
+
+
+def add_delta(deltas, values, sign):
+    """
+    Add(sign=1) or subtract(sign=-1) a trial to the changes of statistics.
+    `values` has the values of `STAT_FIELDS` of the trial.
+    """
+    target = values.get("target") or 0
+    for dimension in DIMENSIONS:
+        delta = deltas[(dimension, values[dimension])]
+        delta[0] += sign
+        delta[1] += sign * target
+
+
+def get_stat_values(trial):
+    return {field: getattr(trial, field) for field in STAT_FIELDS}
+
+
+def apply_deltas(deltas):
+    """
+    Apply the changes to the statistics with a constant number of queries.
+    Call it in the transaction which changes the trials.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta != [0, 0]}
+    if not deltas:
+        return
+    query = Q()
+    for dimension in DIMENSIONS:
+        values = [value for key, value in deltas if key == dimension]
+        if values:
+            query |= Q(dimension=dimension, value__in=values)
+    stats = {
+        (stat.dimension, stat.value): stat for stat in TrialStat.objects.filter(query)
+    }
+    created = []
+    for key, (count, target) in deltas.items():
+        stat = stats.get(key)
+        if stat is None:
+            stat = TrialStat(dimension=key[0], value=key[1])
+            created.append(stat)
+        stat.count += count
+        stat.target += target
+    TrialStat.objects.bulk_create(created)
+    TrialStat.objects.bulk_update(
+        [stat for stat in stats.values() if stat.count > 0], ["count", "target"]
+    )
+    TrialStat.objects.filter(
+        id__in=[s.id for s in stats.values() if s.count <= 0]
+    ).delete()
+
+
+def rebuild_stats():
+    """
+    Rebuild all the statistics from the trials.
+    Call it in the transaction which changes the trials.
+    """
+    TrialStat.objects.all().delete()
+    TrialStat.objects.bulk_create(
+        TrialStat(
+            dimension=dimension,
+            value=row[dimension],
+            count=row["count"],
+            target=row["target"] or 0,
+        )
+        for dimension in DIMENSIONS
+        for row in Trial.objects.values(dimension)
+        .order_by()
+        .annotate(count=Count("id"), target=Sum("target"))
+    )
@@ -1,3 +1,1478 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import csv
+import gzip
+import io
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+from unittest import mock
+import requests
+from asgiref.sync import async_to_sync
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.http import HttpResponse
+from django.db import DatabaseError, connection
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from trials import readmodel
+from trials.async_views import AsyncTrialsLookupView, AsyncTrialsView, AsyncTrialView
+from trials.cache import bump_dataset_version, get_dataset_version
+from trials.cron import (
+    SYNC_MAX_AGE,
+    SYNC_MAX_AGE_MARGIN,
+    log_updated_data,
+    update_data,
+    upsert_batch,
+)
+from trials.metrics import Histogram, collect_metrics, count, timed
+from trials.middleware import request_latency_middleware
+from trials.models import SyncRun, Trial, TrialRevision, TrialStat
+from trials.pagination import (
+    LimitOffsetCountPagination,
+    PageNumberCountPagination,
+    count_queryset,
+    update_table_statistics,
+)
+from trials.periods import parse_period
+from trials.sources import (
+    KEY_COLUMN,
+    TRIAL_MAPPING,
+    Source,
+    get_sources,
+    iter_sources,
+    load_sources,
+)
+from trials.stats import rebuild_stats
+from trials.views import find_records, get_trials
+from trials.utils.fakeapi import make_row
+from trials.utils.requests import DEFAULT_PER_PAGE, FetchError
+from trials.utils.snapshots import (
+    iter_snapshot,
+    list_snapshots,
+    prune_snapshots,
+    save_pages,
+)
 
-# Create your tests here.
+LOCMEM_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "versions": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "versions",
+    },
+}
+
+
+def new_counter():
+    return {"created": 0, "fail": 0, "updated": 0, "removed": 0}
+
+
+def to_text(rows):
+    """
+    Get the rows as they are read from a snapshot.
+    """
+    return [{column: str(value) for column, value in row.items()} for row in rows]
+
+
+def get_stats():
+    return set(TrialStat.objects.values_list("dimension", "value", "count", "target"))
+
+
+def get_revisions():
+    return set(TrialRevision.objects.values_list("number", "action"))
+
+
+class DataPathMixin:
+    """
+    Keep the snapshots and the sync lock of a test in a temporary directory.
+    """
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.data_path = Path(directory.name)
+        (self.data_path / "objects").mkdir()
+        for target, path in (
+            ("trials.utils.snapshots.DATA_PATH", self.data_path),
+            ("trials.utils.snapshots.OBJECT_PATH", self.data_path / "objects"),
+            ("trials.utils.locks.SYNC_LOCK_PATH", self.data_path / "sync.lock"),
+        ):
+            patcher = mock.patch(target, path)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CacheTestCase(TestCase):
+    """
+    Start a test with the empty caches in memory.
+    """
+
+    def setUp(self):
+        super().setUp()
+        for alias in LOCMEM_CACHES:
+            caches[alias].clear()
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, body):
+        self.body = body
+        self.text = str(body)
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.body
+
+
+class FakeAPITestCase(DataPathMixin, CacheTestCase):
+    """
+    Sync the trials from a fake API which serves `rows`
+        and fails the pages in `failing_pages` without retries.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.rows = [make_row(i) for i in range(250)]
+        self.failing_pages = set()
+        for target, new in (
+            ("trials.utils.requests.get_response", self.get_response),
+            ("trials.utils.requests.MAX_RETRIES", 0),
+        ):
+            patcher = mock.patch(target, new)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get_response(self, url, page, per_page):
+        if page in self.failing_pages:
+            raise requests.ConnectionError(f"page {page} is failed")
+        start = (page - 1) * per_page
+        data = self.rows[start : start + per_page]
+        return FakeResponse(
+            {
+                "currentCount": len(data),
+                "data": data,
+                "matchCount": len(self.rows),
+                "page": page,
+                "perPage": per_page,
+                "totalCount": len(self.rows),
+            }
+        )
+
+    def upsert(self, rows):
+        with contextlib.redirect_stdout(io.StringIO()):
+            upsert_batch(rows, new_counter())
+
+    def get_numbers(self):
+        return set(Trial.objects.values_list("number", flat=True))
+
+    def update_data(self, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            update_data(**kwargs)
+        return SyncRun.objects.last()
+
+
+class UpsertBatchTests(TestCase):
+    def upsert(self, rows, at=None):
+        counter = new_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            upsert_batch(rows, counter, at)
+        return counter
+
+    def assertStatsRebuilt(self):
+        # The deltas of the batches must end up same as counting all the trials.
+        stats = get_stats()
+        rebuild_stats()
+        self.assertEqual(stats, get_stats())
+
+    def test_create(self):
+        counter = self.upsert([make_row(i) for i in range(10)])
+        self.assertEqual(counter, {**new_counter(), "created": 10})
+        self.assertEqual(Trial.objects.count(), 10)
+        trial = Trial.objects.get(number="C0000001")
+        self.assertEqual(trial.name, "임상연구 1")
+        self.assertEqual(trial.target, 1)
+        self.assertIsNone(Trial.objects.get(number="C0000000").target)
+        self.assertEqual(trial.start_date, date(2001, 1, 1))
+        self.assertEqual(trial.end_date, date(2022, 12, 31))
+        self.assertFalse(trial.period_parse_failed)
+        revision = TrialRevision.objects.get(number="C0000001")
+        self.assertEqual(revision.action, TrialRevision.Action.CREATED)
+        self.assertNotIn("number", revision.changes)
+        self.assertEqual(revision.changes["name"], "임상연구 1")
+        self.assertIn(("stage", "2상", 2, 7), get_stats())
+        self.assertStatsRebuilt()
+
+    def test_update(self):
+        rows = [make_row(i) for i in range(10)]
+        self.upsert(rows)
+        stats = get_stats()
+        rows[3] = {**rows[3], "과제명": "새 과제명", "진료과": "새 진료과"}
+        counter = self.upsert(rows)
+        self.assertEqual(counter, {**new_counter(), "updated": 1})
+        trial = Trial.objects.get(number="C0000003")
+        self.assertEqual((trial.name, trial.department), ("새 과제명", "새 진료과"))
+        self.assertEqual(Trial.objects.filter(name__startswith="임상연구").count(), 9)
+        revision = TrialRevision.objects.filter(
+            action=TrialRevision.Action.UPDATED
+        ).get()
+        self.assertEqual(revision.number, "C0000003")
+        self.assertEqual(revision.changes, {"name": "새 과제명", "department": "새 진료과"})
+        changed = get_stats() ^ stats
+        self.assertEqual(
+            {(dimension, value) for dimension, value, _, _ in changed},
+            {("department", "진료과 3"), ("department", "새 진료과")},
+        )
+        self.assertStatsRebuilt()
+
+    def test_fail(self):
+        rows = [make_row(i) for i in range(3)]
+        rows[1] = {**rows[1], "전체목표연구대상자수": "many"}
+        rows[2] = {**rows[2], KEY_COLUMN: ""}
+        counter = self.upsert(rows)
+        self.assertEqual(counter, {**new_counter(), "created": 1, "fail": 2})
+        self.assertEqual(
+            list(Trial.objects.values_list("number", flat=True)), ["C0000000"]
+        )
+
+    def test_at(self):
+        at = timezone.now() - timedelta(days=30)
+        self.upsert([make_row(0)], at)
+        trial = Trial.objects.get()
+        self.assertEqual((trial.created_at, trial.updated_at), (at, at))
+        self.assertEqual(TrialRevision.objects.get().created_at, at)
+
+    def test_period_parse_failed(self):
+        self.upsert([{**make_row(0), "연구기간": "승인일로부터 2년"}])
+        trial = Trial.objects.get()
+        self.assertEqual((trial.start_date, trial.end_date), (None, None))
+        self.assertTrue(trial.period_parse_failed)
+
+    def test_unchanged(self):
+        rows = [make_row(i) for i in range(10)]
+        self.upsert(rows)
+        updated_at = dict(Trial.objects.values_list("number", "updated_at"))
+        with CaptureQueriesContext(connection) as queries:
+            counter = self.upsert(rows)
+        self.assertEqual(counter, new_counter())
+        # Only the hashes are read, and nothing is written.
+        statements = [query["sql"].split()[0] for query in queries]
+        self.assertEqual(statements.count("SELECT"), 1)
+        self.assertFalse({"INSERT", "UPDATE", "DELETE"} & set(statements))
+        self.assertEqual(TrialRevision.objects.count(), 10)
+        self.assertEqual(
+            updated_at, dict(Trial.objects.values_list("number", "updated_at"))
+        )
+
+    def test_hash(self):
+        rows = [make_row(i) for i in range(2)]
+        self.upsert(rows)
+        first, second = Trial.objects.order_by("number")
+        self.assertEqual(len(first.source_hash), 64)
+        self.assertNotEqual(first.source_hash, second.source_hash)
+        # The order of the columns does not change the hash.
+        self.upsert([dict(reversed(rows[0].items()))])
+        self.assertEqual(Trial.objects.get(id=first.id).source_hash, first.source_hash)
+
+    def test_rehash(self):
+        rows = [make_row(i) for i in range(10)]
+        self.upsert(rows)
+        source_hash = Trial.objects.get(number="C0000005").source_hash
+        Trial.objects.filter(number="C0000005").update(source_hash="")
+        counter = self.upsert(rows)
+        # The trial without a hash is compared, but it is not changed.
+        self.assertEqual(counter, new_counter())
+        self.assertEqual(Trial.objects.get(number="C0000005").source_hash, source_hash)
+        self.assertEqual(TrialRevision.objects.count(), 10)
+
+    def test_constant_queries(self):
+        # The number of queries does not depend on the size of the batch,
+        #   as long as SQLite does not split a bulk query by its variables.
+        query_counts = []
+        for size in (5, 50):
+            for model in (Trial, TrialRevision, TrialStat):
+                model.objects.all().delete()
+            rows = [make_row(i) for i in range(size)]
+            with CaptureQueriesContext(connection) as queries:
+                self.upsert(rows)
+            query_counts.append(len(queries))
+        self.assertEqual(query_counts[0], query_counts[1])
+
+
+class InitTrialTests(FakeAPITestCase):
+    def inittrial(self, *args):
+        call_command("inittrial", *args, stdout=io.StringIO())
+        return SyncRun.objects.last()
+
+    def test_replace(self):
+        self.upsert([make_row(i) for i in range(10)])
+        TrialRevision.objects.all().delete()
+        self.rows = [make_row(i) for i in range(5, 15)]
+        self.rows[2] = {**self.rows[2], "과제명": "새 과제명"}
+        run = self.inittrial()
+        self.assertEqual(run.status, SyncRun.Status.SUCCESS)
+        self.assertEqual(self.get_numbers(), {row[KEY_COLUMN] for row in self.rows})
+        # Only the real changes are recorded.
+        self.assertEqual(
+            get_revisions(),
+            {
+                *((make_row(i)[KEY_COLUMN], "removed") for i in range(5)),
+                (make_row(7)[KEY_COLUMN], "updated"),
+                *((make_row(i)[KEY_COLUMN], "created") for i in range(10, 15)),
+            },
+        )
+        revision = TrialRevision.objects.get(action=TrialRevision.Action.UPDATED)
+        self.assertEqual(revision.changes, {"name": "새 과제명"})
+
+    def test_failed_chunk(self):
+        bulk_create = Trial.objects.bulk_create
+        calls = []
+
+        def fail_second_chunk(objs, *args, **kwargs):
+            calls.append(objs)
+            if len(calls) == 2:
+                raise DatabaseError("disk I/O error")
+            return bulk_create(objs, *args, **kwargs)
+
+        self.rows = [make_row(i) for i in range(30)]
+        with mock.patch.object(Trial.objects, "bulk_create", fail_second_chunk):
+            run = self.inittrial("--batch-size", "10")
+        self.assertEqual(run.status, SyncRun.Status.SUCCESS)
+        # Only the failed chunk is rolled back with its revisions.
+        expected = {row[KEY_COLUMN] for row in self.rows[:10] + self.rows[20:]}
+        self.assertEqual(self.get_numbers(), expected)
+        self.assertEqual({number for number, _ in get_revisions()}, expected)
+
+    def test_failed_data_clears_fingerprint(self):
+        self.rows[-1] = {**self.rows[-1], "전체목표연구대상자수": "many"}
+        run = self.inittrial()
+        self.assertEqual(run.status, SyncRun.Status.SUCCESS)
+        self.assertEqual(run.fingerprint, "")
+        # The next sync is not skipped to sync the failed data again.
+        self.assertEqual(self.update_data().status, SyncRun.Status.SUCCESS)
+
+    def test_rollback(self):
+        self.upsert([make_row(i) for i in range(10)])
+        self.failing_pages = {2}
+        with self.assertRaises(FetchError):
+            self.inittrial()
+        self.assertEqual(SyncRun.objects.last().status, SyncRun.Status.FAILED)
+        # The old trials are kept when the load is failed.
+        self.assertEqual(
+            self.get_numbers(), {make_row(i)[KEY_COLUMN] for i in range(10)}
+        )
+
+
+class UpdateDataTests(FakeAPITestCase):
+    def test_sync(self):
+        run = self.update_data()
+        self.assertEqual(run.status, SyncRun.Status.SUCCESS)
+        self.assertTrue(run.fingerprint)
+        self.assertEqual(run.rows_applied, 250)
+        self.assertEqual(self.get_numbers(), {row[KEY_COLUMN] for row in self.rows})
+
+    def test_skip(self):
+        self.update_data()
+        run = self.update_data()
+        self.assertEqual(run.status, SyncRun.Status.SKIPPED)
+        run = self.update_data(force=True)
+        self.assertEqual(run.status, SyncRun.Status.SUCCESS)
+
+    def test_skip_until_max_age(self):
+        fresh_for = SYNC_MAX_AGE - SYNC_MAX_AGE_MARGIN
+        for started_ago, status in (
+            (fresh_for - timedelta(minutes=1), SyncRun.Status.SKIPPED),
+            (fresh_for + timedelta(seconds=1), SyncRun.Status.SUCCESS),
+            # The run of the cron at the same time yesterday is old.
+            (SYNC_MAX_AGE - timedelta(seconds=5), SyncRun.Status.SUCCESS),
+        ):
+            with self.subTest(started_ago=started_ago):
+                SyncRun.objects.all().delete()
+                self.update_data()
+                SyncRun.objects.update(started_at=timezone.now() - started_ago)
+                self.assertEqual(self.update_data().status, status)
+
+    def test_not_skip_after_failed_data(self):
+        self.rows[-1] = {**self.rows[-1], "전체목표연구대상자수": "many"}
+        run = self.update_data()
+        self.assertEqual(run.status, SyncRun.Status.SUCCESS)
+        self.assertEqual(run.fingerprint, "")
+        self.assertEqual(self.update_data().status, SyncRun.Status.SUCCESS)
+
+    def test_not_skip_without_data(self):
+        self.update_data()
+        self.rows = []
+        run = self.update_data()
+        self.assertEqual(run.status, SyncRun.Status.SUCCESS)
+        self.assertEqual(run.fingerprint, "")
+        # The trials are not removed by an empty response.
+        self.assertEqual(Trial.objects.count(), 250)
+
+    def test_locked(self):
+        with mock.patch("trials.cron.sync_lock") as sync_lock:
+            sync_lock.return_value.__enter__.return_value = False
+            self.assertIsNone(self.update_data())
+        self.assertFalse(SyncRun.objects.exists())
+
+    def test_resume(self):
+        self.rows = [make_row(i) for i in range(300)]
+        self.failing_pages = {3}
+        with self.assertRaises(FetchError):
+            self.update_data()
+        failed_run = SyncRun.objects.last()
+        self.assertEqual(failed_run.status, SyncRun.Status.FAILED)
+        self.assertEqual(failed_run.checkpoints, {get_sources()[0].name: 2})
+        self.assertEqual(failed_run.rows_applied, 2 * DEFAULT_PER_PAGE)
+        self.assertEqual(Trial.objects.count(), 2 * DEFAULT_PER_PAGE)
+        self.failing_pages = set()
+        requested = []
+        get_response = self.get_response
+
+        def record(url, page, per_page):
+            requested.append(page)
+            return get_response(url, page, per_page)
+
+        with mock.patch("trials.utils.requests.get_response", record):
+            run = self.update_data(resume=True)
+        self.assertEqual(run.id, failed_run.id)
+        self.assertEqual(run.status, SyncRun.Status.SUCCESS)
+        self.assertEqual(run.rows_applied, 300)
+        self.assertEqual(self.get_numbers(), {row[KEY_COLUMN] for row in self.rows})
+        # The pages before the checkpoint are not applied again.
+        self.assertEqual(Trial.objects.count(), 300)
+        self.assertEqual(requested[0], 3)
+
+    def test_resume_after_pruned_part(self):
+        self.failing_pages = {2}
+        with self.assertRaises(FetchError):
+            self.update_data()
+        failed_run = SyncRun.objects.last()
+        # The part file of the failed run is pruned before it is resumed.
+        expired = time.time() - 30 * 24 * 60 * 60
+        for part_path in self.data_path.glob("*.part"):
+            os.utime(part_path, (expired, expired))
+        self.assertEqual(prune_snapshots()["parts"], 1)
+        self.failing_pages = set()
+        run = self.update_data(resume=True)
+        self.assertNotEqual(run.id, failed_run.id)
+        self.assertEqual(run.status, SyncRun.Status.SUCCESS)
+        self.assertEqual(run.rows_applied, 250)
+        # The snapshot has all the pages, not only the pages after the checkpoint.
+        self.assertEqual(list(iter_snapshot(list_snapshots()[-1])), to_text(self.rows))
+
+    def test_remove_missing(self):
+        self.update_data()
+        self.rows = self.rows[50:]
+        self.update_data()
+        self.assertEqual(Trial.objects.count(), 200)
+        self.assertEqual(
+            TrialRevision.objects.filter(action=TrialRevision.Action.REMOVED).count(),
+            50,
+        )
+        stats = get_stats()
+        rebuild_stats()
+        self.assertEqual(stats, get_stats())
+
+    def test_resume_removes_missing(self):
+        self.update_data()
+        # The first 50 trials are removed and 100 trials are added,
+        #   but the third page is failed.
+        self.rows = [make_row(i) for i in range(50, 350)]
+        self.failing_pages = {3}
+        with self.assertRaises(FetchError):
+            self.update_data()
+        self.failing_pages = set()
+        self.update_data(resume=True)
+        # The resumed run reads all the numbers again to remove the trials.
+        self.assertEqual(self.get_numbers(), {row[KEY_COLUMN] for row in self.rows})
+        self.assertEqual(
+            TrialRevision.objects.filter(action=TrialRevision.Action.REMOVED).count(),
+            50,
+        )
+        # The pages of the failed and the resumed run are in one snapshot.
+        self.assertEqual(list(iter_snapshot(list_snapshots()[-1])), to_text(self.rows))
+
+    def test_resume_without_failed_run(self):
+        self.update_data()
+        run = self.update_data(resume=True)
+        self.assertEqual(run.status, SyncRun.Status.SKIPPED)
+
+    def test_retry(self):
+        attempts = []
+        get_response = self.get_response
+
+        def fail_once(url, page, per_page):
+            attempts.append(page)
+            if page == 2 and attempts.count(page) == 1:
+                raise requests.ConnectionError("connection reset")
+            return get_response(url, page, per_page)
+
+        with mock.patch("trials.utils.requests.get_response", fail_once), mock.patch(
+            "trials.utils.requests.MAX_RETRIES", 1
+        ), mock.patch("trials.utils.requests.time.sleep") as sleep:
+            run = self.update_data()
+        self.assertEqual(run.status, SyncRun.Status.SUCCESS)
+        self.assertEqual(run.metrics["retries"], 1)
+        self.assertEqual(sleep.call_count, 1)
+        self.assertEqual(Trial.objects.count(), 250)
+
+    def test_log_restores_stdout(self):
+        self.failing_pages = {2}
+        stdout = sys.stdout
+        with mock.patch("trials.cron.LOG_PATH", self.data_path):
+            with self.assertRaises(FetchError):
+                log_updated_data()
+        self.assertIs(sys.stdout, stdout)
+        (log,) = self.data_path.glob("*.log")
+        self.assertIn("Metrics:", log.read_text())
+
+
+class ResponseCacheTests(CacheTestCase):
+    url = "/api/v1/trials/"
+
+    def setUp(self):
+        super().setUp()
+        with contextlib.redirect_stdout(io.StringIO()):
+            upsert_batch([make_row(i) for i in range(30)], new_counter())
+        bump_dataset_version()
+
+    def test_not_modified(self):
+        for url in (self.url, f"{self.url}{make_row(0)[KEY_COLUMN]}/"):
+            response = self.client.get(url, {"days": "0"})
+            self.assertEqual(response.status_code, 200)
+            etag = response["ETag"]
+            response = self.client.get(url, {"days": "0"}, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response["ETag"], etag)
+            self.assertEqual(response.content, b"")
+
+    def test_cached_until_bump(self):
+        response = self.client.get(self.url, {"days": "0"})
+        self.assertEqual(response.json()["count"], 30)
+        with contextlib.redirect_stdout(io.StringIO()):
+            upsert_batch([make_row(30)], new_counter())
+        cached = self.client.get(self.url, {"days": "0"})
+        self.assertEqual(cached.json(), response.json())
+        self.assertEqual(cached["ETag"], response["ETag"])
+        bump_dataset_version()
+        bumped = self.client.get(self.url, {"days": "0"})
+        self.assertEqual(bumped.json()["count"], 31)
+        self.assertNotEqual(bumped["ETag"], response["ETag"])
+
+    @override_settings(ALLOWED_HOSTS=["*"])
+    def test_key_of_host(self):
+        params = {"days": "0", "limit": "5"}
+        first = self.client.get(self.url, params, HTTP_HOST="first.example")
+        second = self.client.get(self.url, params, HTTP_HOST="second.example")
+        self.assertIn("first.example", first.json()["next"])
+        self.assertIn("second.example", second.json()["next"])
+        self.assertNotEqual(first["ETag"], second["ETag"])
+
+    def test_version_survives_cull(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_caches = {
+                "default": {
+                    "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                    "LOCATION": Path(directory) / "cache",
+                    "OPTIONS": {"MAX_ENTRIES": 10, "CULL_FREQUENCY": 1},
+                },
+                "versions": {
+                    "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                    "LOCATION": Path(directory) / "versions",
+                },
+            }
+            with override_settings(CACHES=file_caches):
+                version = get_dataset_version()
+                for i in range(100):
+                    cache.set(f"key-{i}", i)
+                self.assertLessEqual(
+                    len(list((Path(directory) / "cache").iterdir())), 10
+                )
+                self.assertEqual(get_dataset_version(), version)
+
+
+class TrialsFilterTests(CacheTestCase):
+    url = "/api/v1/trials/"
+
+    def setUp(self):
+        super().setUp()
+        self.rows = [make_row(i) for i in range(30)]
+        with contextlib.redirect_stdout(io.StringIO()):
+            upsert_batch(self.rows, new_counter())
+
+    def search(self, **params):
+        response = self.client.get(self.url, {"days": "0", "limit": "100", **params})
+        self.assertEqual(response.status_code, 200)
+        return {trial["number"] for trial in response.json()["results"]}
+
+    def expect(self, predicate):
+        return {row[KEY_COLUMN] for row in self.rows if predicate(row)}
+
+    def test_fields(self):
+        self.assertEqual(
+            self.search(stage="2상", kind="중재연구"),
+            self.expect(
+                lambda row: row["임상시험단계(연구모형)"] == "2상" and row["연구종류"] == "중재연구"
+            ),
+        )
+        self.assertEqual(self.search(department="진료과 3", stage="2상"), set())
+
+    def test_fts(self):
+        for keyword in ("연구 1", "기관 2", "임상연구"):
+            self.assertEqual(
+                self.search(q=keyword),
+                self.expect(lambda row: keyword in row["과제명"] + row["연구책임기관"]),
+            )
+        Trial.objects.filter(number="C0000001").update(name="새 이름")
+        Trial.objects.filter(number="C0000010").delete()
+        bump_dataset_version()
+        self.assertEqual(self.search(q="새 이름"), {"C0000001"})
+        self.assertEqual(
+            self.search(q="연구 1"),
+            self.expect(lambda row: "연구 1" in row["과제명"]) - {"C0000001", "C0000010"},
+        )
+
+    def test_icontains(self):
+        # The keyword is too short for the trigram tokenizer.
+        self.assertEqual(
+            self.search(q="관 7"),
+            self.expect(lambda row: "관 7" in row["연구책임기관"]),
+        )
+        with mock.patch("trials.search.supports_fts", return_value=False):
+            self.assertEqual(
+                self.search(q="연구 1"),
+                self.expect(lambda row: "연구 1" in row["과제명"]),
+            )
+
+    def test_combined(self):
+        self.assertEqual(
+            self.search(q="연구 1", kind="중재연구", end_to="2022-12-31"),
+            self.expect(
+                lambda row: "연구 1" in row["과제명"]
+                and row["연구종류"] == "중재연구"
+                and row["연구기간"].endswith(("2021-12-31", "2022-12-31"))
+            ),
+        )
+
+    def test_dates(self):
+        # The period of a row is from 2000 + i % 20 to the end of 2021 + i % 5.
+        self.assertEqual(
+            self.search(active_from="2002-01-01", active_to="2002-06-30"),
+            self.expect(lambda row: row["연구기간"].startswith(("2000", "2001", "2002"))),
+        )
+        self.assertEqual(
+            self.search(end_from="2024-01-01", end_to="2025-12-31"),
+            self.expect(lambda row: row["연구기간"].endswith(("2024-12-31", "2025-12-31"))),
+        )
+
+    def test_invalid_date(self):
+        response = self.client.get(self.url, {"active_from": "2023-13-01"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("active_from", response.json()["message"])
+
+
+class TrialsExportTests(CacheTestCase):
+    url = "/api/v1/trials/export/"
+
+    def setUp(self):
+        super().setUp()
+        self.numbers = [make_row(i)[KEY_COLUMN] for i in range(30)]
+        with contextlib.redirect_stdout(io.StringIO()):
+            upsert_batch([make_row(i) for i in range(30)], new_counter())
+
+    def export(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response, b"".join(response.streaming_content)
+
+    def test_ndjson(self):
+        response, content = self.export()
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        trials = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual([trial["number"] for trial in trials], self.numbers)
+        self.assertEqual(trials[1]["name"], "임상연구 1")
+
+    def test_csv(self):
+        response, content = self.export(format="csv", kind="관찰연구")
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        trials = list(csv.DictReader(io.StringIO(content.decode())))
+        self.assertEqual([trial["number"] for trial in trials], self.numbers[1::2])
+        self.assertEqual(trials[0]["name"], "임상연구 1")
+
+    def test_gzip(self):
+        _, content = self.export(format="csv")
+        response = self.client.get(
+            self.url, {"format": "csv"}, HTTP_ACCEPT_ENCODING="gzip, deflate"
+        )
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        compressed = b"".join(response.streaming_content)
+        self.assertEqual(gzip.decompress(compressed), content)
+
+    def test_invalid(self):
+        for params in ({"format": "xml"}, {"end_to": "someday"}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("message", response.json())
+
+
+class TrialsLookupTests(CacheTestCase):
+    url = "/api/v1/trials/lookup/"
+
+    def setUp(self):
+        super().setUp()
+        with contextlib.redirect_stdout(io.StringIO()):
+            upsert_batch([make_row(i) for i in range(30)], new_counter())
+
+    def test_get(self):
+        numbers = ["C0000003", "C9999999", "C0000001", "C0000003"]
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {"number": numbers})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(
+            [trial["number"] for trial in data["results"]], ["C0000003", "C0000001"]
+        )
+        self.assertEqual(data["missing"], ["C9999999"])
+
+    def test_post(self):
+        numbers = [make_row(i)[KEY_COLUMN] for i in range(25, 35)]
+        with self.assertNumQueries(1):
+            response = self.client.post(
+                self.url, {"numbers": numbers}, content_type="application/json"
+            )
+        data = response.json()
+        self.assertEqual([trial["number"] for trial in data["results"]], numbers[:5])
+        self.assertEqual(data["missing"], numbers[5:])
+
+    def test_limit(self):
+        with mock.patch("trials.views.LOOKUP_LIMIT", 3):
+            response = self.client.get(self.url, {"number": ["A", "B", "C", "A"]})
+            self.assertEqual(response.status_code, 200)
+            response = self.client.get(self.url, {"number": ["A", "B", "C", "D"]})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("At most 3", response.json()["message"])
+
+    def test_invalid(self):
+        for body in ({}, {"numbers": "C0000001"}, {"numbers": [1]}, {"numbers": []}):
+            response = self.client.post(self.url, body, content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("message", response.json())
+
+
+class TrialChangesTests(CacheTestCase):
+    url = "/api/v1/trials/changes/"
+
+    def setUp(self):
+        super().setUp()
+        rows = [make_row(i) for i in range(5)]
+        with contextlib.redirect_stdout(io.StringIO()):
+            upsert_batch(rows, new_counter())
+            rows[0] = {**rows[0], "과제명": "새 과제명"}
+            upsert_batch(rows, new_counter())
+
+    def test_follow(self):
+        revisions = []
+        response = self.client.get(self.url, {"limit": "2"})
+        while True:
+            data = response.json()
+            revisions += data["results"]
+            if data["next"] is None:
+                break
+            response = self.client.get(data["next"])
+        self.assertEqual(len(revisions), 6)
+        self.assertEqual(data["last_id"], revisions[-1]["id"])
+        self.assertEqual(revisions[-1]["number"], "C0000000")
+        self.assertEqual(revisions[-1]["action"], TrialRevision.Action.UPDATED)
+        self.assertEqual(revisions[-1]["changes"], {"name": "새 과제명"})
+        response = self.client.get(self.url, {"since": data["last_id"]})
+        self.assertEqual(response.json()["results"], [])
+        self.assertEqual(response.json()["last_id"], data["last_id"])
+
+    def test_since_time(self):
+        TrialRevision.objects.filter(action=TrialRevision.Action.CREATED).update(
+            created_at=timezone.now() - timedelta(days=1)
+        )
+        since_time = (timezone.now() - timedelta(hours=1)).isoformat()
+        response = self.client.get(self.url, {"since_time": since_time})
+        self.assertEqual(
+            [revision["action"] for revision in response.json()["results"]],
+            [TrialRevision.Action.UPDATED],
+        )
+
+    def test_invalid(self):
+        for params in ({"since": "-1"}, {"limit": "a"}, {"since_time": "yesterday"}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400)
+
+
+class TrialStatsTests(CacheTestCase):
+    url = "/api/v1/trials/stats/"
+
+    def setUp(self):
+        super().setUp()
+        with contextlib.redirect_stdout(io.StringIO()):
+            upsert_batch([make_row(i) for i in range(10)], new_counter())
+
+    def test_dimensions(self):
+        response = self.client.get(self.url, {"dimension": ["kind", "stage"]})
+        data = response.json()
+        self.assertEqual(set(data), {"kind", "stage"})
+        self.assertEqual(
+            data["kind"],
+            [
+                {"value": "관찰연구", "count": 5, "target": 25},
+                {"value": "중재연구", "count": 5, "target": 20},
+            ],
+        )
+        response = self.client.get(self.url)
+        self.assertEqual(
+            set(response.json()), {"department", "stage", "kind", "institution"}
+        )
+
+    def test_invalid(self):
+        response = self.client.get(self.url, {"dimension": "name"})
+        self.assertEqual(response.status_code, 400)
+
+
+class ParsePeriodTests(TestCase):
+    def test_formats(self):
+        expected = (date(2020, 1, 1), date(2022, 12, 31), False)
+        for period in (
+            "2020-01-01 ~ 2022-12-31",
+            "2020.01.01~2022.12.31",
+            "2020/1/1 - 2022/12/31",
+            "2020년 1월 1일 ~ 2022년 12월 31일",
+            "2020-01 ~ 2022-12",
+        ):
+            with self.subTest(period=period):
+                self.assertEqual(parse_period(period), expected)
+
+    def test_month_ends_at_last_day(self):
+        self.assertEqual(
+            parse_period("2019-02 ~ 2020-02"),
+            (date(2019, 2, 1), date(2020, 2, 29), False),
+        )
+
+    def test_failed(self):
+        for period in (
+            "",
+            None,
+            "2020-01-01",
+            "2020-13-01 ~ 2022-12-31",
+            "2022-12-31 ~ 2020-01-01",
+            "2020-01-01 ~ 2021-01-01 ~ 2022-01-01",
+        ):
+            with self.subTest(period=period):
+                self.assertEqual(parse_period(period), (None, None, True))
+
+
+class AsyncViewTests(CacheTestCase):
+    """
+    The async views respond same as the sync views.
+    """
+
+    url = "/api/v1/trials/"
+
+    def setUp(self):
+        super().setUp()
+        with contextlib.redirect_stdout(io.StringIO()):
+            upsert_batch([make_row(i) for i in range(30)], new_counter())
+        self.factory = AsyncRequestFactory()
+
+    def assertSameResponse(self, view, request, response, **kwargs):
+        async_response = async_to_sync(view.as_view())(request, **kwargs)
+        # The handler renders the responses delegated to the sync views.
+        if hasattr(async_response, "render"):
+            async_response.render()
+        self.assertEqual(async_response.status_code, response.status_code)
+        self.assertEqual(json.loads(async_response.content), response.json())
+        if "ETag" in response:
+            self.assertEqual(async_response["ETag"], response["ETag"])
+
+    def test_list(self):
+        for params in (
+            {"days": "0", "limit": "5", "offset": "5"},
+            {"days": "0", "q": "연구 1", "kind": "중재연구", "order": "id"},
+            {"days": "0", "end_to": "2022-12-31", "limit": "100"},
+            {"days": "0", "pagination": "page", "page": "2"},
+            {"days": "0", "offset": "100"},
+            {"order": "name"},
+        ):
+            with self.subTest(params=params):
+                self.assertSameResponse(
+                    AsyncTrialsView,
+                    self.factory.get(self.url, params),
+                    self.client.get(self.url, params),
+                )
+
+    def test_list_by_strategies(self):
+        params = {"days": "0", "limit": "10", "offset": "10"}
+        for strategy in ("exact", "estimated", "none"):
+            # The strategies are read from the settings when the module is loaded.
+            with self.subTest(strategy=strategy), mock.patch.object(
+                LimitOffsetCountPagination, "count_strategy", strategy
+            ):
+                response = self.client.get(self.url, params)
+                if strategy == "none":
+                    self.assertIsNone(response.json()["count"])
+                self.assertSameResponse(
+                    AsyncTrialsView, self.factory.get(self.url, params), response
+                )
+                bump_dataset_version()
+
+    def test_lookup(self):
+        url = f"{self.url}lookup/"
+        params = {"number": ["C0000003", "C9999999", "C0000001"]}
+        self.assertSameResponse(
+            AsyncTrialsLookupView,
+            self.factory.get(url, params),
+            self.client.get(url, params),
+        )
+        for body in ({"numbers": ["C0000002", "C9999999"]}, {"numbers": "C0000002"}):
+            self.assertSameResponse(
+                AsyncTrialsLookupView,
+                self.factory.post(url, body, content_type="application/json"),
+                self.client.post(url, body, content_type="application/json"),
+            )
+
+    def test_detail(self):
+        for number in ("C0000001", "C9999999"):
+            url = f"{self.url}{number}/"
+            self.assertSameResponse(
+                AsyncTrialView,
+                self.factory.get(url),
+                self.client.get(url),
+                pk=number,
+            )
+
+
+class MetricsTests(FakeAPITestCase):
+    url = "/api/v1/trials/metrics/"
+    # A sample is a name with optional labels and a number.
+    sample_pattern = re.compile(r"^[a-z_]+(\{[^}]*\})? -?[0-9.e+-]+$")
+
+    def get_metrics(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        lines = response.content.decode().splitlines()
+        for line in lines:
+            if not line.startswith("#"):
+                self.assertRegex(line, self.sample_pattern)
+        return dict(line.rsplit(" ", 1) for line in lines if not line.startswith("#"))
+
+    def test_collect_metrics(self):
+        with collect_metrics() as metrics:
+            count("pages")
+            count("rows", 10)
+            with timed("db"):
+                Trial.objects.count()
+        count("pages")  # Not counted out of a sync
+        data = metrics.to_dict()
+        self.assertEqual((data["pages"], data["rows"], data["queries"]), (1, 10, 1))
+        self.assertEqual(set(data["stages"]), {"db"})
+        self.assertGreater(data["peak_memory"], 0)
+
+    def test_sync(self):
+        run = self.update_data()
+        self.assertEqual(run.metrics["pages"], 3)
+        self.assertEqual(run.metrics["rows"], 250)
+        samples = self.get_metrics()
+        self.assertEqual(samples['trials_sync_runs_total{status="success"}'], "1")
+        self.assertEqual(samples["trials_sync_rows"], "250")
+        self.assertEqual(samples["trials_sync_last_success"], "1")
+        self.assertIn('trials_sync_stage_seconds{stage="http"}', samples)
+
+    def test_request_latency(self):
+        key = 'trials_request_duration_seconds_count{view="list"}'
+        before = int(self.get_metrics().get(key, 0))
+        self.client.get("/api/v1/trials/")
+        self.client.get("/api/v1/trials/")
+        self.assertEqual(int(self.get_metrics()[key]), before + 2)
+
+    def test_async_middleware(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        middleware = request_latency_middleware(get_response)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        request = self.client.get("/api/v1/trials/").wsgi_request
+        with mock.patch("trials.middleware.request_latency") as histogram:
+            async_to_sync(middleware)(request)
+        histogram.observe.assert_called_once_with("list", mock.ANY)
+
+    def test_histogram(self):
+        histogram = Histogram((0.1, 1))
+        for value in (0.05, 0.5, 5):
+            histogram.observe("list", value)
+        self.assertEqual(
+            histogram.render("latency", "view"),
+            [
+                'latency_bucket{view="list",le="0.1"} 1',
+                'latency_bucket{view="list",le="1"} 2',
+                'latency_bucket{view="list",le="+Inf"} 3',
+                'latency_sum{view="list"} 5.55',
+                'latency_count{view="list"} 3',
+            ],
+        )
+
+
+class SnapshotTests(DataPathMixin, TestCase):
+    def save(self, name, rows):
+        for _ in save_pages([(1, rows)], name):
+            pass
+
+    def test_commit(self):
+        rows = [make_row(i) for i in range(5)]
+        self.save("20230101-090000", rows[:3])
+        self.assertEqual(
+            [path.name for path in list_snapshots()], ["20230101-090000.ref"]
+        )
+        self.assertEqual(list(iter_snapshot(list_snapshots()[0])), to_text(rows[:3]))
+        self.assertEqual(list(self.data_path.glob("*.part")), [])
+
+    def test_missing_column(self):
+        rows = [make_row(i) for i in range(3)]
+        del rows[1][KEY_COLUMN]
+        self.save("20230101-090000", rows)
+        saved = list(iter_snapshot(list_snapshots()[0]))
+        self.assertEqual(list(saved[0]), list(make_row(0)))
+        self.assertEqual(saved[1][KEY_COLUMN], "")
+        self.assertEqual(saved[2], to_text([make_row(2)])[0])
+
+    def test_dedup(self):
+        rows = [make_row(i) for i in range(3)]
+        self.save("20230101-090000", rows)
+        self.save("20230102-090000", rows)
+        self.save("20230103-090000", rows[:2])
+        refs = list_snapshots()
+        self.assertEqual(len(refs), 3)
+        self.assertEqual(refs[0].read_text(), refs[1].read_text())
+        self.assertEqual(len(list((self.data_path / "objects").iterdir())), 2)
+
+    def test_prune(self):
+        names = [
+            f"202301{day:02d}-{hour:02d}0000" for day in (1, 2, 3) for hour in (9, 18)
+        ]
+        for i, name in enumerate(names):
+            self.save(name, [make_row(i)])
+        old_part = self.data_path / "20230104-090000.part"
+        old_part.write_bytes(b"")
+        expired = time.time() - 8 * 24 * 60 * 60
+        os.utime(old_part, (expired, expired))
+        new_part = self.data_path / "20230105-090000.part"
+        new_part.write_bytes(b"")
+        removed = prune_snapshots(keep_last=1, keep_days=None, part_days=7)
+        # The last snapshot of every day is kept by default.
+        self.assertEqual(removed, {"refs": 3, "objects": 3, "parts": 1})
+        self.assertEqual(
+            [path.stem for path in list_snapshots()],
+            ["20230101-180000", "20230102-180000", "20230103-180000"],
+        )
+        self.assertEqual(len(list((self.data_path / "objects").iterdir())), 3)
+        self.assertTrue(new_part.exists())
+        # Only the last snapshots are kept for the days since now.
+        removed = prune_snapshots(keep_last=1, keep_days=30)
+        self.assertEqual(removed, {"refs": 2, "objects": 2, "parts": 0})
+        self.assertEqual([path.stem for path in list_snapshots()], ["20230103-180000"])
+
+
+class ReplayTests(FakeAPITestCase):
+    def setUp(self):
+        super().setUp()
+        names = (f"2023010{day}-090000" for day in range(1, 10))
+        patcher = mock.patch("trials.cron.new_snapshot_name", lambda: next(names))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_state(self):
+        trials = set(
+            Trial.objects.values_list("number", "name", "department", "target")
+        )
+        revisions = {
+            (number, action, json.dumps(changes, sort_keys=True))
+            for number, action, changes in TrialRevision.objects.values_list(
+                "number", "action", "changes"
+            )
+        }
+        return trials, revisions, get_stats()
+
+    def replay(self, *args):
+        call_command("replay", "--workers", "2", *args, stdout=io.StringIO())
+        return SyncRun.objects.last()
+
+    def test_reset(self):
+        self.update_data()
+        # Some trials are removed, added and changed.
+        self.rows = [make_row(i) for i in range(50, 300)]
+        self.rows[0] = {**self.rows[0], "과제명": "새 과제명", "진료과": "새 진료과"}
+        self.update_data(force=True)
+        self.rows = self.rows[:100]
+        self.update_data(force=True)
+        state = self.get_state()
+        run = self.replay("--reset")
+        self.assertEqual(self.get_state(), state)
+        self.assertEqual(run.status, SyncRun.Status.SUCCESS)
+        self.assertEqual(run.fingerprint, "")
+        self.assertEqual(run.snapshot, "20230103-090000.ref")
+        # The changes are recorded at the time of their snapshots.
+        removed = TrialRevision.objects.filter(action=TrialRevision.Action.REMOVED)
+        self.assertEqual(
+            {revision.created_at.date() for revision in removed},
+            {date(2023, 1, 2), date(2023, 1, 3)},
+        )
+        self.assertEqual(
+            Trial.objects.get(number="C0000050").updated_at.date(), date(2023, 1, 2)
+        )
+        # The next sync is neither skipped nor resumed.
+        run = self.update_data(resume=True)
+        self.assertEqual(run.status, SyncRun.Status.SUCCESS)
+
+    def test_since_until(self):
+        self.update_data()
+        self.rows = self.rows[:100]
+        self.update_data(force=True)
+        self.rows = self.rows[:50]
+        self.update_data(force=True)
+        self.replay("--reset", "--since", "20230102", "--until", "20230102")
+        self.assertEqual(Trial.objects.count(), 100)
+        with self.assertRaises(CommandError):
+            self.replay("--since", "20230104")
+
+
+class CountStrategyTests(CacheTestCase):
+    def setUp(self):
+        super().setUp()
+        with contextlib.redirect_stdout(io.StringIO()):
+            upsert_batch([make_row(i) for i in range(30)], new_counter())
+
+    def get_request(self, **params):
+        return Request(APIRequestFactory().get("/api/v1/trials/", params))
+
+    def add_trial(self, i):
+        with contextlib.redirect_stdout(io.StringIO()):
+            upsert_batch([make_row(i)], new_counter())
+
+    def test_exact(self):
+        request = self.get_request()
+        self.assertEqual(count_queryset(Trial.objects.all(), "exact", request), 30)
+        self.add_trial(30)
+        self.assertEqual(count_queryset(Trial.objects.all(), "exact", request), 31)
+
+    def test_cached(self):
+        trials = Trial.objects.all()
+        self.assertEqual(count_queryset(trials, "cached", self.get_request()), 30)
+        self.add_trial(30)
+        # The count is kept for the dataset version, whatever the page is.
+        request = self.get_request(offset=10)
+        with self.assertNumQueries(0):
+            self.assertEqual(count_queryset(trials, "cached", request), 30)
+        # But the filters have their own counts.
+        request = self.get_request(department="진료과 1")
+        trials = Trial.objects.filter(department="진료과 1")
+        self.assertEqual(count_queryset(trials, "cached", request), 2)
+        bump_dataset_version()
+        request = self.get_request()
+        self.assertEqual(count_queryset(Trial.objects.all(), "cached", request), 31)
+
+    def test_estimated(self):
+        update_table_statistics(Trial._meta.db_table)
+        self.add_trial(30)
+        request = self.get_request()
+        # The statistics are not updated after the trial is added.
+        self.assertEqual(count_queryset(Trial.objects.all(), "estimated", request), 30)
+        # The filtered trials can not be estimated, so they are counted.
+        request = self.get_request(department="진료과 1")
+        trials = Trial.objects.filter(department="진료과 1")
+        self.assertEqual(count_queryset(trials, "estimated", request), 2)
+
+    def test_none(self):
+        paginator = LimitOffsetCountPagination()
+        paginator.count_strategy = "none"
+        trials = Trial.objects.order_by("id")
+        rows = paginator.paginate_queryset(trials, self.get_request(limit=20, offset=0))
+        self.assertEqual(len(rows), 20)
+        self.assertIsNone(paginator.count)
+        self.assertIn("offset=20", paginator.get_next_link())
+        rows = paginator.paginate_queryset(
+            trials, self.get_request(limit=20, offset=20)
+        )
+        self.assertEqual(len(rows), 10)
+        self.assertIsNone(paginator.get_next_link())
+
+    def test_page_none(self):
+        paginator = PageNumberCountPagination()
+        paginator.count_strategy = "none"
+        trials = Trial.objects.order_by("id")
+        # Only the page and one more trial are read without a count.
+        with self.assertNumQueries(1):
+            rows = paginator.paginate_queryset(trials, self.get_request(page=1))
+        self.assertEqual(len(rows), 5)
+        self.assertIn("page=2", paginator.get_next_link())
+        rows = paginator.paginate_queryset(trials, self.get_request(page=6))
+        self.assertEqual(len(rows), 5)
+        self.assertIsNone(paginator.get_next_link())
+
+
+class IterSourcesTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.rows = {
+            "http://a.example/": [make_row(i) for i in range(250)],
+            "http://b.example/": [make_row(i) for i in range(1000, 1150)],
+        }
+        self.sources = [
+            Source("a", "http://a.example/"),
+            Source("b", "http://b.example/"),
+        ]
+        self.slow_url = None
+        self.failing_url = None
+        for target, new in (
+            ("trials.utils.requests.get_response", self.get_response),
+            ("trials.utils.requests.MAX_RETRIES", 0),
+        ):
+            patcher = mock.patch(target, new)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get_response(self, url, page, per_page):
+        if url == self.slow_url:
+            time.sleep(0.02)
+        if url == self.failing_url and page == 2:
+            raise requests.ConnectionError(f"page {page} is failed")
+        rows = self.rows[url]
+        data = rows[(page - 1) * per_page : page * per_page]
+        return FakeResponse(
+            {
+                "currentCount": len(data),
+                "data": data,
+                "matchCount": len(rows),
+                "page": page,
+                "perPage": per_page,
+                "totalCount": len(rows),
+            }
+        )
+
+    def get_pages(self, checkpoints=None):
+        return [key for key, _ in iter_sources(self.sources, checkpoints)]
+
+    def test_order(self):
+        expected = [("a", 1), ("b", 1), ("a", 2), ("b", 2), ("a", 3)]
+        # The order does not depend on which source is faster.
+        for slow_url in self.rows:
+            self.slow_url = slow_url
+            self.assertEqual(self.get_pages(), expected)
+        # A resumed run continues in the same order.
+        self.assertEqual(self.get_pages({"a": 2, "b": 1}), expected[3:])
+
+    def test_to_row(self):
+        (_, data), *_ = iter_sources(self.sources[1:])
+        self.assertEqual(data[0], make_row(1000))
+
+    def test_fail(self):
+        self.failing_url = "http://b.example/"
+        with self.assertRaises(FetchError):
+            self.get_pages()
+
+
+class SourceTests(TestCase):
+    def test_validate(self):
+        Source("default", "http://a.example/").validate()
+        for mapping in (
+            {"과제번호": "number", "과제명": "title"},
+            {"과제명": "name"},
+        ):
+            with self.subTest(mapping=mapping), self.assertRaises(ImproperlyConfigured):
+                Source("other", "http://b.example/", mapping).validate()
+
+    def test_load_sources(self):
+        sources = load_sources({"a": {"url": "http://a.example/"}})
+        self.assertEqual(list(sources), ["a"])
+        for config in ({}, {"a": {"url": "http://a.example/", "model": "Trial"}}):
+            with self.subTest(config=config), self.assertRaises(ImproperlyConfigured):
+                load_sources(config)
+
+    def test_to_row(self):
+        source = Source(
+            "other", "http://b.example/", {"번호": "number", "진료과목": "department"}
+        )
+        row = source.to_row({"번호": "B1", "진료과목": "내과", "비고": "-"})
+        # The fields which the source does not have are left out.
+        self.assertEqual(row, {KEY_COLUMN: "B1", "진료과": "내과"})
+        self.assertEqual(source.to_row({"진료과목": "내과"}), {"진료과": "내과"})
+
+
+class MultiSourceTests(FakeAPITestCase):
+    def setUp(self):
+        super().setUp()
+        mapping = dict(TRIAL_MAPPING)
+        del mapping["진료과"]
+        sources = {
+            "a": Source("a", "http://a.example/", mapping),
+            "b": Source(
+                "b", "http://b.example/", {"번호": "number", "진료과목": "department"}
+            ),
+        }
+        patcher = mock.patch("trials.sources.SOURCES", sources)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.rows = [make_row(i) for i in range(120)]
+        self.departments = [
+            {"번호": row[KEY_COLUMN], "진료과목": f"새 진료과 {i}"}
+            for i, row in enumerate(self.rows)
+        ]
+
+    def get_response(self, url, page, per_page):
+        rows = self.rows if url == "http://a.example/" else self.departments
+        data = rows[(page - 1) * per_page : page * per_page]
+        return FakeResponse(
+            {
+                "currentCount": len(data),
+                "data": data,
+                "matchCount": len(rows),
+                "page": page,
+                "perPage": per_page,
+                "totalCount": len(rows),
+            }
+        )
+
+    def test_merge(self):
+        run = self.update_data()
+        self.assertEqual(run.status, SyncRun.Status.SUCCESS)
+        trial = Trial.objects.get(number="C0000001")
+        # The fields from each source are kept.
+        self.assertEqual((trial.name, trial.department), ("임상연구 1", "새 진료과 1"))
+        revisions = TrialRevision.objects.count()
+        self.update_data(force=True)
+        self.assertEqual(TrialRevision.objects.count(), revisions)
+        trial = Trial.objects.get(number="C0000001")
+        self.assertEqual((trial.name, trial.department), ("임상연구 1", "새 진료과 1"))
+
+
+class ReadModelTests(CacheTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        with contextlib.redirect_stdout(io.StringIO()):
+            upsert_batch([make_row(i) for i in range(120)], new_counter())
+        now = timezone.now()
+        # Some trials are not updated for the default days,
+        #   and some are updated at the same time to test the tiebreaker.
+        for start, days in ((0, 30), (40, 3), (80, 3)):
+            Trial.objects.filter(
+                number__in=[make_row(i)[KEY_COLUMN] for i in range(start, start + 20)]
+            ).update(updated_at=now - timedelta(days=days))
+
+    def setUp(self):
+        super().setUp()
+        for target, new in (
+            ("trials.readmodel.ENABLED", True),
+            ("trials.readmodel.current", None),
+        ):
+            patcher = mock.patch(target, new)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_find(self):
+        read_model = readmodel.build_read_model("test")
+        for params in (
+            {},
+            {"days": "0"},
+            {"days": "5"},
+            {"order": "updated_at"},
+            {"order": "id", "days": "0"},
+            {"order": "-id"},
+            {"department": "진료과 3", "days": "0"},
+            {"department": "진료과 3", "stage": "1상", "order": "updated_at"},
+            {"institution": "기관 7", "days": "0", "order": "-id"},
+            {"kind": "관찰연구"},
+            {"kind": "중재연구", "department": "진료과 4", "days": "0"},
+            {"department": "없는 진료과"},
+        ):
+            with self.subTest(params=params):
+                records = find_records(read_model, params)
+                self.assertEqual(
+                    [record.id for record in records],
+                    list(get_trials(params).values_list("id", flat=True)),
+                )
+
+    def test_find_slices(self):
+        read_model = readmodel.build_read_model("test")
+        params = {"days": "0"}
+        records = find_records(read_model, params)
+        ids = list(get_trials(params).values_list("id", flat=True))
+        self.assertEqual([record.id for record in records[10:25]], ids[10:25])
+        self.assertEqual(records[-1].id, ids[-1])
+
+    def test_not_found_by_read_model(self):
+        read_model = readmodel.build_read_model("test")
+        self.assertIsNone(find_records(read_model, {"q": "임상연구"}))
+        self.assertIsNone(find_records(read_model, {"end_from": "2020-01-01"}))
+
+    def test_get(self):
+        read_model = readmodel.build_read_model("test")
+        trial = Trial.objects.get(number="C0000007")
+        self.assertEqual(read_model.get("C0000007").id, trial.id)
+        self.assertIsNone(read_model.get("C9999999"))
+
+    def test_responses(self):
+        for url in (
+            "/api/v1/trials/?days=0&limit=10&offset=30",
+            "/api/v1/trials/?department=진료과 3&order=id",
+            "/api/v1/trials/C0000007/",
+            "/api/v1/trials/lookup/?number=C0000007&number=C9999999",
+        ):
+            with self.subTest(url=url):
+                readmodel.get_read_model()
+                with self.assertNumQueries(0):
+                    in_memory = self.client.get(url)
+                cache.clear()
+                with mock.patch("trials.readmodel.ENABLED", False):
+                    from_db = self.client.get(url)
+                self.assertEqual(in_memory.json(), from_db.json())
+
+    def test_rebuild_by_version(self):
+        with mock.patch(
+            "trials.readmodel.build_read_model", wraps=readmodel.build_read_model
+        ) as build:
+            model = readmodel.get_read_model()
+            self.assertIs(readmodel.get_read_model(), model)
+            bump_dataset_version()
+            self.assertIsNot(readmodel.get_read_model(), model)
+        self.assertEqual(build.call_count, 2)
+
+    def test_not_rebuilt_by_cull(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_caches = {
+                "default": {
+                    "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                    "LOCATION": Path(directory) / "cache",
+                    "OPTIONS": {"MAX_ENTRIES": 10, "CULL_FREQUENCY": 1},
+                },
+                "versions": {
+                    "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                    "LOCATION": Path(directory) / "versions",
+                },
+            }
+            with override_settings(CACHES=file_caches), mock.patch(
+                "trials.readmodel.build_read_model", wraps=readmodel.build_read_model
+            ) as build:
+                model = readmodel.get_read_model()
+                # The responses fill the default cache and cull it many times.
+                for i in range(30):
+                    self.client.get("/api/v1/trials/", {"days": "0", "offset": i})
+                self.assertIs(readmodel.get_read_model(), model)
+        build.assert_called_once()
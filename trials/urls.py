@@ -1,7 +1,27 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+if getattr(settings, "TRIALS_ASYNC_VIEWS", False):
+    # Serve the read path with async views under ASGI.
+    from . import async_views
+
+    trials_view = async_views.AsyncTrialsView.as_view()
+    lookup_view = async_views.AsyncTrialsLookupView.as_view()
+    trial_view = async_views.AsyncTrialView.as_view()
+else:
+    trials_view = views.TrialsView.as_view()
+    lookup_view = views.TrialsLookupView.as_view()
+    trial_view = views.TrialView.as_view()
+
+# The names label the latency of the requests in the metrics.
+app_name = "trials"
 urlpatterns = [
-    path("", views.TrialsView.as_view()),
-    path("<pk>/", views.TrialView.as_view()),
+    path("", trials_view, name="list"),
+    path("export/", views.TrialsExportView.as_view(), name="export"),
+    path("lookup/", lookup_view, name="lookup"),
+    path("changes/", views.TrialChangesView.as_view(), name="changes"),
+    path("stats/", views.TrialStatsView.as_view(), name="stats"),
+    path("metrics/", views.TrialsMetricsView.as_view(), name="metrics"),
+    path("<pk>/", trial_view, name="detail"),
 ]
@@ -0,0 +1,98 @@
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from .requests import Row
+
+STAGES = ("1상", "2상", "3상", "4상", "관찰연구")
+KINDS = ("중재연구", "관찰연구")
+
+
+def make_row(i: int) -> Row:
+    """
+    Make the i-th synthetic data in the same form as API.
+    The data is same for the same index.
+    """
+    return {
+        "과제명": f"임상연구 {i}",
+        "과제번호": f"C{i:07d}",
+        "연구기간": f"{2000 + i % 20}-01-01 ~ {2021 + i % 5}-12-31",
+        "연구범위": "국내" if i % 3 else "국외",
+        "연구종류": KINDS[i % len(KINDS)],
+        "연구책임기관": f"기관 {i % 50}",
+        "임상시험단계(연구모형)": STAGES[i % len(STAGES)],
+        "전체목표연구대상자수": i % 1000 or "",
+        "진료과": f"진료과 {i % 20}",
+    }
+
+
+def get_page_body(page: int, per_page: int, rows: int) -> dict:
+    """
+    Get the body of a page of `rows` synthetic data.
+    """
+    start = min((page - 1) * per_page, rows)
+    data = [make_row(i) for i in range(start, min(start + per_page, rows))]
+    return {
+        "currentCount": len(data),
+        "data": data,
+        "matchCount": rows,
+        "page": page,
+        "perPage": per_page,
+        "totalCount": rows,
+    }
+
+
+class FakeAPIHandler(BaseHTTPRequestHandler):
+    """
+    Serve the pages of the synthetic data for any path.
+    The settings are in the server.
+    """
+
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        try:
+            page = max(int(params.get("page", ["1"])[0]), 1)
+            per_page = max(int(params.get("perPage", ["10"])[0]), 1)
+        except ValueError:
+            return self.send_json(400, {"code": -1, "msg": "invalid parameters"})
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.random.random() < self.server.error_rate:
+            return self.send_json(500, {"code": -5, "msg": "fake error"})
+        self.send_json(200, get_page_body(page, per_page, self.server.rows))
+
+    def send_json(self, status: int, body: dict) -> None:
+        content = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        # Do not print every request.
+        pass
+
+
+def make_server(
+    host: str = "127.0.0.1",
+    port: int = 0,
+    rows: int = 1000,
+    latency: float = 0.0,
+    error_rate: float = 0.0,
+    seed: int | None = None,
+) -> ThreadingHTTPServer:
+    """
+    Make a local stand-in of API.
+    Each request waits `latency` seconds,
+        and fails with 500 at the rate of `error_rate`.
+    If the port is 0, a free port is used.
+    """
+    server = ThreadingHTTPServer((host, port), FakeAPIHandler)
+    server.daemon_threads = True
+    server.rows = rows
+    server.latency = latency
+    server.error_rate = error_rate
+    server.random = random.Random(seed)
+    return server
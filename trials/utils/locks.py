@@ -0,0 +1,36 @@
+import fcntl
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from .requests import DATA_PATH
+
+SYNC_LOCK_PATH = DATA_PATH / "sync.lock"
+
+
+@contextmanager
+def file_lock(path: Path) -> Iterator[bool]:
+    """
+    Try to hold an exclusive lock of the file across processes.
+    Yield True if the lock is held,
+        or False if another process already holds it.
+    The lock is released when the process exits, even if it is killed.
+    """
+    with open(path, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@contextmanager
+def sync_lock() -> Iterator[bool]:
+    """
+    Lock for syncing trials so that only one sync runs at a time.
+    """
+    with file_lock(SYNC_LOCK_PATH) as locked:
+        yield locked
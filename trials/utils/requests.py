@@ -1,23 +1,108 @@
-import csv
-from datetime import datetime
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice
 import requests
 import environ
 from pathlib import Path
+from urllib.parse import urlsplit
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from ..metrics import count, timed
 
 env = environ.Env(
     # set casting, default value
     DEBUG=(bool, False)
 )
-environ.Env.read_env(env_file=".env")
+environ.Env.read_env(env_file=Path(settings.BASE_DIR) / ".env")
 DEFAULT_PER_PAGE = 100
+PROBE_PER_PAGE = 1
 DATA_DIR_LITERAL = "data"
-DATA_PATH = Path(DATA_DIR_LITERAL)
+# Under the project, not the working directory(e.g. of cron),
+#   so every process uses the same snapshots and sync lock.
+DATA_PATH = Path(settings.BASE_DIR) / DATA_DIR_LITERAL
 DATA_PATH.mkdir(exist_ok=True)
+# The number of pages fetched at the same time.
+CONCURRENCY = env.int("API_CONCURRENCY", default=8)
+# The maximum number of requests per second sent to a host(e.g. odcloud).
+RATE_LIMIT = env.float("API_RATE_LIMIT", default=10.0)
+TIMEOUT = env.float("API_TIMEOUT", default=30.0)
+# A failed page is retried with exponential backoff and jitter.
+MAX_RETRIES = env.int("API_MAX_RETRIES", default=5)
+BACKOFF_BASE = env.float("API_BACKOFF_BASE", default=0.5)
+BACKOFF_MAX = env.float("API_BACKOFF_MAX", default=30.0)
 
 
-def get_response(page: int, per_page: int) -> requests.models.Response:
+class FetchError(Exception):
     """
-    Get response from API
+    API does not return a valid page even after retries.
+    """
+
+
+class RateLimiter:
+    """
+    Thread-safe client-side rate limiter.
+    Each `wait` call reserves the next free slot
+        and sleeps until that slot comes.
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def make_session() -> requests.Session:
+    """
+    Make a keep-alive session.
+    The connection pool of each host is as large as the concurrency
+        so that every worker can reuse its connection.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=max(CONCURRENCY, 1))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+session = make_session()
+# The sources on the same host share the rate limit.
+rate_limiters: dict[str, RateLimiter] = {}
+rate_limiters_lock = threading.Lock()
+Row = dict[str, str | int]
+Page = tuple[int, list[Row]]
+
+
+def get_rate_limiter(url: str) -> RateLimiter:
+    """
+    Get the rate limiter of the host of the URL.
+    """
+    host = urlsplit(url).netloc
+    with rate_limiters_lock:
+        if host not in rate_limiters:
+            rate_limiters[host] = RateLimiter(RATE_LIMIT)
+        return rate_limiters[host]
+
+
+def get_response(url: str, page: int, per_page: int) -> requests.models.Response:
+    """
+    Get response from API of the URL
     {
         'currentCount': int,
         'data': [
@@ -39,61 +124,122 @@ def get_response(page: int, per_page: int) -> requests.models.Response:
         'totalCount': int
     }
     """
-    URL = (
-        "https://api.odcloud.kr/api/3074271/v1/"
-        "uddi:cfc19dda-6f75-4c57-86a8-bb9c8b103887"
-    )
-    response = requests.get(
-        URL,
+    get_rate_limiter(url).wait()
+    response = session.get(
+        url,
         params={
             "page": page,
             "perPage": per_page,
             "serviceKey": env("API_KEY"),
         },
+        timeout=TIMEOUT,
     )
     return response
 
 
-def get_data() -> list[dict[str, str | int]]:
+def get_json(url: str, page: int, per_page: int) -> dict:
     """
-    Get all the data from API.
-    Currently(2022-11-30), the API returns 145 data.
+    Get the JSON of a page from API of the URL.
+    If the request fails or the response is not a valid page,
+        retry it with exponential backoff and full jitter.
+    Raise FetchError after `MAX_RETRIES` retries.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            with timed("http"):
+                response = get_response(url, page, per_page)
+                response.raise_for_status()
+            with timed("decode"):
+                body = response.json()
+            if not isinstance(body, dict) or "data" not in body:
+                raise ValueError(f"invalid page: {response.text[:200]}")
+            return body
+        except (requests.RequestException, ValueError) as e:
+            if attempt == MAX_RETRIES:
+                raise FetchError(
+                    f"Page {page} is failed after {attempt + 1} attempts: {e}"
+                ) from e
+            count("retries")
+            delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt))
+            print(f"Page {page} got {e}. Retry after {delay:.2f} seconds.")
+            time.sleep(delay)
+
+
+def get_page_data(url: str, page: int, per_page: int) -> list[Row]:
+    """
+    Get the data of a page from API of the URL.
+    """
+    return get_json(url, page, per_page).get("data")
+
+
+def get_fingerprint(url: str) -> str:
+    """
+    Probe API of the URL with a small page
+        and get the fingerprint of the total count and the first page.
+    If API returns no data, return an empty string.
     """
-    page = 1
+    probe = get_json(url, 1, PROBE_PER_PAGE)
+    total_count = probe.get("totalCount")
+    if not total_count:
+        return ""
+    first_page = json.dumps(probe.get("data"), sort_keys=True, ensure_ascii=False)
+    digest = hashlib.sha256(first_page.encode("utf-8")).hexdigest()
+    return f"{total_count}:{digest}"
+
+
+def iter_pages(
+    url: str, start_page: int = 1, concurrency: int = CONCURRENCY
+) -> Iterator[Page]:
+    """
+    Yield `(page, data)` of the pages from API of the URL in order,
+        from `start_page` to the last page.
+    After the first page, the other pages are fetched
+        by `concurrency` workers at the same time,
+        but at most `concurrency` pages are waiting to be yielded.
+    So the memory usage does not depend on the total number of data.
+    """
+    page = start_page
     per_page = DEFAULT_PER_PAGE  # 100
-    response = get_response(page, per_page)
-    initdata = response.json()
+    initdata = get_json(url, page, per_page)
     # From initdata, get the total number of data and the first page.
     total_count = initdata.get("totalCount")  # The total number of data
     if not total_count:
-        # If the API returns an empty list(by error or something), return an empty list.
+        # If the API returns an empty list(by error or something), yield nothing.
         print(__name__, "No data")
-        print(f"status code: {response.status_code}")
-        print(f"{response.text}")
-        return []
-    total_page = total_count // per_page + 2
+        print(f"{initdata}")
+        return
+    last_page = math.ceil(total_count / per_page)
     # The number of pages to get all the data
-    data = initdata.get("data") + sum(
-        (
-            get_response(page, per_page).json().get("data")
-            for page in range(2, total_page)
-            # Get the data from the second page to the last page
-        ),
-        [],
-    )
-    return data
+    if page > last_page:
+        return
+    yield page, initdata.get("data")
+    pages = iter(range(page + 1, last_page + 1))
+    # Get the data from the next page to the last page
+    concurrency = max(concurrency, 1)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque(
+            (page, executor.submit(get_page_data, url, page, per_page))
+            for page in islice(pages, concurrency)
+        )
+        while pending:
+            page, future = pending.popleft()
+            data = future.result()
+            for next_page in islice(pages, 1):
+                # Keep the workers busy while the page is consumed.
+                pending.append(
+                    (
+                        next_page,
+                        executor.submit(get_page_data, url, next_page, per_page),
+                    )
+                )
+            yield page, data
 
 
-def save_data_to_csv(data: list[dict[str, str | int]]) -> None:
+def get_data(url: str, concurrency: int = CONCURRENCY) -> list[Row]:
     """
-    Save `list[dict]` type data to csv file.
-    The file is saved in the `data` directory.
-    The name is the time in `%Y%m%d-%H%M%S`(yyyymmdd-HHMMSS) format
-        when this function is executed.
-    The fieldname is defined by the key of the first dictionary of the list.
+    Get all the data from API of the URL.
+    Currently(2022-11-30), the API returns 145 data.
+    `chain` joins the pages in linear time.
     """
-    now = datetime.now().strftime("%Y%m%d-%H%M%S")
-    with open(DATA_PATH / f"{now}.csv", "w", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, data[0].keys())
-        writer.writeheader()
-        writer.writerows(data)
+    pages = iter_pages(url, concurrency=concurrency)
+    return list(chain.from_iterable(data for _, data in pages))
@@ -0,0 +1,248 @@
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import time
+from collections.abc import Iterable, Iterator
+from datetime import datetime, timedelta
+from pathlib import Path
+from ..metrics import timed
+from ..sources import TRIAL_MAPPING
+from .requests import DATA_PATH, Page, Row, env
+
+# A snapshot is a pointer(<name>.ref) to an object(objects/<sha256>.csv.gz).
+# The object is named by the hash of its csv content,
+#   so the same data is stored only once.
+# While a run is writing, its pages are appended to <name>.part
+#   as gzip members, so the run can be resumed.
+OBJECT_PATH = DATA_PATH / "objects"
+OBJECT_PATH.mkdir(exist_ok=True)
+REF_SUFFIX = ".ref"
+PART_SUFFIX = ".part"
+OBJECT_SUFFIX = ".csv.gz"
+# Retention: the last snapshots and the last snapshot of each day
+#   for the days are kept, and the others are removed by `prune_snapshots`.
+# The snapshots are the history of the replay,
+#   so the last snapshot of every day is kept unless the days are set.
+SNAPSHOT_KEEP_LAST = env.int("SNAPSHOT_KEEP_LAST", default=10)
+SNAPSHOT_KEEP_DAYS = env.int("SNAPSHOT_KEEP_DAYS", default=None)
+# The part files not written for the days are of abandoned runs.
+SNAPSHOT_PART_DAYS = env.int("SNAPSHOT_PART_DAYS", default=7)
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def new_snapshot_name() -> str:
+    """
+    Get the name of a new snapshot.
+    The name is the time in `%Y%m%d-%H%M%S`(yyyymmdd-HHMMSS) format
+        when this function is executed.
+    """
+    return datetime.now().strftime("%Y%m%d-%H%M%S")
+
+
+def save_pages(pages: Iterable[Page], name: str | None = None) -> Iterator[Page]:
+    """
+    Save the pages to a snapshot while passing them through.
+    Each page is written after the next stage(e.g. DB) is done with it,
+        so the next stage can use the same stream without reading the data twice,
+        and a page which is not applied is not saved.
+    Each page is a gzip member appended to the part file of the snapshot,
+        so the pages of a resumed run are appended to the same file.
+    After all the pages are passed, the snapshot is committed.
+    The header is the columns of the trials,
+        and a column which a row does not have is written empty.
+    """
+    name = name or new_snapshot_name()
+    part_path = DATA_PATH / f"{name}{PART_SUFFIX}"
+    with open(part_path, "ab") as f:
+        has_header = f.tell() > 0
+        for page, data in pages:
+            yield page, data
+            if not data:
+                continue
+            with timed("snapshot"):
+                buffer = io.StringIO()
+                writer = csv.DictWriter(buffer, list(TRIAL_MAPPING), restval="")
+                if not has_header:
+                    writer.writeheader()
+                    has_header = True
+                writer.writerows(data)
+                f.write(gzip.compress(buffer.getvalue().encode("utf-8"), mtime=0))
+                f.flush()
+    with timed("snapshot"):
+        commit_snapshot(name)
+
+
+def has_part(name: str) -> bool:
+    """
+    Check that the snapshot has the part file of an unfinished run.
+    The part file is removed by `prune_snapshots` if it is not written for days.
+    """
+    return bool(name) and (DATA_PATH / f"{name}{PART_SUFFIX}").exists()
+
+
+def save_data(data: list[Row]) -> None:
+    """
+    Save `list[dict]` type data to a new snapshot.
+    """
+    for _ in save_pages([(1, data)]):
+        pass
+
+
+def hash_stream(stream) -> str:
+    """
+    Get sha256 of the stream of bytes in chunks.
+    """
+    digest = hashlib.sha256()
+    while chunk := stream.read(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_ref(name: str, digest: str) -> None:
+    """
+    Point the snapshot to the object atomically.
+    """
+    tmp_path = DATA_PATH / f"{name}{REF_SUFFIX}.tmp"
+    tmp_path.write_text(f"{digest}\n")
+    os.replace(tmp_path, DATA_PATH / f"{name}{REF_SUFFIX}")
+
+
+def commit_snapshot(name: str) -> str | None:
+    """
+    Move the part file of the snapshot to the object of its content,
+        or remove it if the same object already exists.
+    Return the hash of the content, or None if nothing is written.
+    """
+    part_path = DATA_PATH / f"{name}{PART_SUFFIX}"
+    if not part_path.exists() or part_path.stat().st_size == 0:
+        part_path.unlink(missing_ok=True)
+        return None
+    with gzip.open(part_path, "rb") as f:
+        digest = hash_stream(f)
+    object_path = OBJECT_PATH / f"{digest}{OBJECT_SUFFIX}"
+    if object_path.exists():
+        part_path.unlink()
+    else:
+        os.replace(part_path, object_path)
+    write_ref(name, digest)
+    return digest
+
+
+def list_snapshots() -> list[Path]:
+    """
+    Get the paths of the snapshots and the legacy csv files in order of time.
+    """
+    paths = [*DATA_PATH.glob(f"*{REF_SUFFIX}"), *DATA_PATH.glob("*.csv")]
+    return sorted(paths, key=lambda path: path.name)
+
+
+def open_snapshot(path: Path):
+    """
+    Open the csv text of a snapshot, an object or a legacy csv file.
+    """
+    if path.suffix == REF_SUFFIX:
+        digest = path.read_text().strip()
+        path = OBJECT_PATH / f"{digest}{OBJECT_SUFFIX}"
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, encoding="utf-8", newline="")
+
+
+def iter_snapshot(path: Path) -> Iterator[Row]:
+    """
+    Yield the data of a snapshot one by one.
+    """
+    with open_snapshot(path) as f:
+        yield from csv.DictReader(f)
+
+
+def compact_snapshots() -> int:
+    """
+    Move the legacy csv files to the objects.
+    Return the number of the moved files.
+    """
+    moved = 0
+    for csv_path in sorted(DATA_PATH.glob("*.csv")):
+        with open(csv_path, "rb") as f:
+            digest = hash_stream(f)
+        object_path = OBJECT_PATH / f"{digest}{OBJECT_SUFFIX}"
+        if not object_path.exists():
+            tmp_path = OBJECT_PATH / f"{digest}.tmp"
+            with open(csv_path, "rb") as src, gzip.open(tmp_path, "wb") as dst:
+                shutil.copyfileobj(src, dst, HASH_CHUNK_SIZE)
+            os.replace(tmp_path, object_path)
+        write_ref(csv_path.stem, digest)
+        csv_path.unlink()
+        moved += 1
+    return moved
+
+
+def prune_snapshots(
+    keep_last: int = SNAPSHOT_KEEP_LAST,
+    keep_days: int | None = SNAPSHOT_KEEP_DAYS,
+    part_days: int = SNAPSHOT_PART_DAYS,
+) -> dict[str, int]:
+    """
+    Remove the snapshots except the last `keep_last` snapshots
+        and the last snapshot of each day for `keep_days` days.
+    If `keep_days` is None, the last snapshot of every day is kept.
+    The objects which no snapshot points to are removed,
+        and so are the part files not written for `part_days` days.
+    Return the numbers of the removed refs, objects and parts.
+    """
+    removed = {"refs": 0, "objects": 0, "parts": 0}
+    refs = sorted(DATA_PATH.glob(f"*{REF_SUFFIX}"), key=lambda path: path.name)
+    since = ""
+    if keep_days is not None:
+        since = (datetime.now() - timedelta(days=keep_days)).strftime("%Y%m%d")
+    kept_days = set()
+    for index, ref in enumerate(reversed(refs)):
+        day = ref.name[:8]
+        if index < keep_last or (day >= since and day not in kept_days):
+            kept_days.add(day)
+            continue
+        ref.unlink()
+        removed["refs"] += 1
+    digests = {ref.read_text().strip() for ref in DATA_PATH.glob(f"*{REF_SUFFIX}")}
+    for object_path in OBJECT_PATH.glob(f"*{OBJECT_SUFFIX}"):
+        if object_path.name.removesuffix(OBJECT_SUFFIX) not in digests:
+            object_path.unlink()
+            removed["objects"] += 1
+    expired = time.time() - part_days * 24 * 60 * 60
+    for part_path in DATA_PATH.glob(f"*{PART_SUFFIX}"):
+        if part_path.stat().st_mtime < expired:
+            part_path.unlink()
+            removed["parts"] += 1
+    return removed
+
+
+def hash_row(row: Row) -> str:
+    """
+    Get the stable hash of a data of a snapshot.
+    """
+    normalized = json.dumps(row, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def diff_snapshots(
+    previous: Path | None, current: Path, key: str
+) -> tuple[list[Row], set[str]]:
+    """
+    Get the data of the current snapshot which is new or changed
+        since the previous snapshot, and all the keys of the current snapshot.
+    It is run in other processes, so it does not use DB.
+    """
+    hashes = {}
+    if previous is not None:
+        hashes = {row.get(key): hash_row(row) for row in iter_snapshot(previous)}
+    changed = []
+    keys = set()
+    for row in iter_snapshot(current):
+        keys.add(row.get(key))
+        if hashes.get(row.get(key)) != hash_row(row):
+            changed.append(row)
+    return changed, keys
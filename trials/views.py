@@ -1,20 +1,167 @@
-from datetime import datetime, timedelta
+from collections.abc import Sequence
+from datetime import timedelta
 from django.conf import settings
+from django.db.models import QuerySet
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.dateparse import parse_date, parse_datetime
+from django.views import View
 from rest_framework.views import APIView
 from rest_framework.request import Request
 from rest_framework.response import Response
-from rest_framework.pagination import (
-    LimitOffsetPagination,
-    PageNumberPagination,
-    CursorPagination,
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import replace_query_param
+from rest_framework.status import HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND
+from .cache import cache_response
+from .metrics import render_metrics
+from .models import Trial, TrialRevision, TrialStat
+from .pagination import (
+    LimitOffsetCountPagination,
+    PageNumberCountPagination,
+    SequencePagination,
 )
-from rest_framework.status import HTTP_404_NOT_FOUND
-from .models import Trial
-from .serializers import TrialSerializer
+from .readmodel import ReadModel, TrialRecord, get_read_model
+from .renderers import iter_csv, iter_gzip, iter_ndjson
+from .search import search_trials
+from .serializers import TrialRevisionSerializer, TrialValuesSerializer
 
 # Get default page size from settings
 DEFAULT_PAGE_SIZE = settings.REST_FRAMEWORK["PAGE_SIZE"]
 DEFAULT_ORDERING = "-updated_at"
+# Trials updated for the days are listed as default.
+DEFAULT_DAYS = 7
+# Query parameters to filter trials with the same value.
+FILTER_FIELDS = ("department", "institution", "stage", "kind")
+# Query parameters to filter trials by dates(YYYY-MM-DD)
+# The period overlaps with [active_from, active_to],
+# and the end date is in [end_from, end_to].
+DATE_FILTERS = {
+    "active_from": "end_date__gte",
+    "active_to": "start_date__lte",
+    "end_from": "end_date__gte",
+    "end_to": "end_date__lte",
+}
+# The number of trials read from DB at once while exporting
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+# The maximum number of trials looked up by a request
+LOOKUP_LIMIT = getattr(settings, "TRIALS_LOOKUP_LIMIT", 1000)
+# The number of revisions in a response of changes
+DEFAULT_CHANGES_LIMIT = 100
+MAX_CHANGES_LIMIT = 1000
+serializer = TrialValuesSerializer()
+
+
+def filter_trials(trials: QuerySet, params) -> QuerySet:
+    """
+    Filter trials by the query parameters.
+    `department`, `institution`, `stage` and `kind` are matched exactly,
+        `q` is a keyword in `name` or `institution`,
+        and the dates are in `DATE_FILTERS`.
+    Raise ValueError if a date is not valid.
+    """
+    filters = {field: params[field] for field in FILTER_FIELDS if field in params}
+    trials = trials.filter(**filters)
+    # Each date is filtered by itself,
+    #   because some dates have the same lookup(e.g. active_from and end_from).
+    for param, lookup in DATE_FILTERS.items():
+        if param not in params:
+            continue
+        try:
+            value = parse_date(params[param])
+        except ValueError:
+            value = None
+        if value is None:
+            raise ValueError(f"{param} must be a date in YYYY-MM-DD format.")
+        trials = trials.filter(**{lookup: value})
+    if keyword := params.get("q"):
+        trials = search_trials(trials, keyword)
+    return trials
+
+
+# Orderings allowed for clients.
+# Each ordering uses an index and ends with the unique id as a tiebreaker.
+ORDERINGS = {
+    "-updated_at": ("-updated_at", "-id"),
+    "updated_at": ("updated_at", "id"),
+    "-id": ("-id",),
+    "id": ("id",),
+}
+
+
+def get_order_and_days(params) -> tuple[str, int]:
+    """
+    Get the ordering and the days of the list by the query parameters.
+    Raise ValueError if `order` or `days` is not valid.
+    """
+    order = params.get("order", DEFAULT_ORDERING)
+    if order not in ORDERINGS:
+        raise ValueError(f"order must be one of {', '.join(ORDERINGS)}.")
+    days = params.get("days", str(DEFAULT_DAYS))
+    if not days.isdigit():
+        raise ValueError("days must be a non-negative integer.")
+    return order, int(days)
+
+
+def get_trials(params) -> QuerySet:
+    """
+    Get the ordered trials of the list by the query parameters.
+    Raise ValueError if `order`, `days` or a filter is not valid.
+    """
+    order, days = get_order_and_days(params)
+    trials = filter_trials(Trial.objects.all(), params)
+    if days:
+        trials = trials.filter(
+            updated_at__gte=timezone.now() - timedelta(days=days),
+        )
+    return trials.order_by(*ORDERINGS[order])
+
+
+def find_records(read_model: ReadModel, params) -> Sequence[TrialRecord] | None:
+    """
+    Find the ordered trials of the list in the read model.
+    Return None if the read model can not find them by the query parameters,
+        i.e. a keyword or a date.
+    Raise ValueError if `order` or `days` is not valid.
+    """
+    if "q" in params or any(param in params for param in DATE_FILTERS):
+        return None
+    order, days = get_order_and_days(params)
+    filters = {field: params[field] for field in FILTER_FIELDS if field in params}
+    return read_model.find(order, days, filters)
+
+
+def clean_numbers(numbers: list[str]) -> list[str]:
+    """
+    Remove duplicates of the numbers to look up in order.
+    Raise ValueError if there are no numbers or too many numbers.
+    """
+    numbers = list(dict.fromkeys(numbers))
+    if not numbers:
+        raise ValueError("At least one number is required.")
+    if len(numbers) > LOOKUP_LIMIT:
+        raise ValueError(f"At most {LOOKUP_LIMIT} numbers can be looked up at once.")
+    return numbers
+
+
+def get_lookup_data(numbers: list[str], rows) -> dict:
+    """
+    Get the found trials in the order of the numbers,
+        and the numbers which are not found in `missing`.
+    """
+    found = {row["number"]: row for row in rows}
+    return {
+        "results": [
+            serializer.to_representation(found[number])
+            for number in numbers
+            if number in found
+        ],
+        "missing": [number for number in numbers if number not in found],
+    }
 
 
 class TrialsView(APIView):
@@ -24,17 +171,20 @@ class TrialsView(APIView):
         Use PageNumberPagination where pagination is page.
         Use CursorPagination where pagination is cursor.
         Use LimitOffsetPagination as default.
+        The page and limit-offset paginations count the trials
+            by `TRIALS_COUNT_STRATEGIES`.
         """
         match params.get("pagination", "limit"):
             case "page":
                 # Page pagination
                 # If page is given, use PageNumberPagination
-                self.paginator = PageNumberPagination()
+                self.paginator = PageNumberCountPagination()
                 self.paginator.page_size = params.get("page_size", DEFAULT_PAGE_SIZE)
             case "cursor":
                 # Cursor pagination
                 self.paginator = CursorPagination()
-                self.paginator.ordering = params.get("order", DEFAULT_ORDERING)
+                ordering = ORDERINGS[params.get("order", DEFAULT_ORDERING)]
+                self.paginator.ordering = ordering
                 page_size = int(params.get("page_size", DEFAULT_PAGE_SIZE))
                 self.paginator.page_size = page_size
                 # If using cursor pagination
@@ -43,36 +193,238 @@ class TrialsView(APIView):
                 # So, convert page_size to int.
             case _:
                 # Limit-offset pagination
-                self.paginator = LimitOffsetPagination()
+                self.paginator = LimitOffsetCountPagination()
                 self.paginator.default_offset = 0
 
+    @cache_response
     def get(self, request: Request) -> Response:
         """
         Get trials that updated for 7 days.
         GET /api/v1/trials/?page=<page:1>&page_size=<page_size:5>
         GET /api/v1/trials/?cursor=<cursor>&page_size=<page_size:5>
         GET /api/v1/trials/?limit=<limit:5>&offset=<offset:0>
+        The order is one of `ORDERINGS`, `-updated_at` as default.
+        The days can be changed by `days`, and `days=0` gets all trials.
+        Trials can be filtered by `department`, `institution`, `stage`, `kind`,
+            a keyword `q` in name or institution,
+            and the dates `active_from`, `active_to`, `end_from` and `end_to`.
         """
 
-        trials = Trial.objects.filter(
-            updated_at__gte=datetime.now() - timedelta(days=7),
+        params = request.query_params
+        read_model = get_read_model()
+        if read_model is not None and params.get("pagination", "limit") == "limit":
+            try:
+                records = find_records(read_model, params)
+            except ValueError as e:
+                return Response({"message": str(e)}, status=HTTP_400_BAD_REQUEST)
+            if records is not None:
+                self.paginator = SequencePagination()
+                page = self.paginator.paginate_queryset(records, request)
+                return self.paginator.get_paginated_response(serializer.serialize(page))
+        try:
+            trials = get_trials(params)
+        except ValueError as e:
+            return Response({"message": str(e)}, status=HTTP_400_BAD_REQUEST)
+        self.set_paginator(params)
+        rows = trials.values(*serializer.sources)
+        page = self.paginator.paginate_queryset(rows, request)
+        return self.paginator.get_paginated_response(serializer.serialize(page))
+
+
+class TrialsExportView(View):
+    """
+    Stream trials without pagination.
+    It is not an APIView because the formats are not negotiated by DRF.
+    """
+
+    def get(self, request):
+        """
+        Export all trials, or the filtered trials, ordered by id.
+        GET /api/v1/trials/export/?format=<ndjson|csv>
+        The filters are same as TrialsView except `days`.
+        If the client accepts gzip, the stream is compressed.
+        """
+
+        export_format = request.GET.get("format", "ndjson")
+        if export_format not in EXPORT_CONTENT_TYPES:
+            message = f"format must be one of {', '.join(EXPORT_CONTENT_TYPES)}."
+            return JsonResponse({"message": message}, status=HTTP_400_BAD_REQUEST)
+        try:
+            trials = filter_trials(Trial.objects.order_by("id"), request.GET)
+        except ValueError as e:
+            return JsonResponse({"message": str(e)}, status=HTTP_400_BAD_REQUEST)
+        rows = (
+            serializer.to_representation(row)
+            for row in trials.values(*serializer.sources).iterator(
+                chunk_size=EXPORT_CHUNK_SIZE
+            )
+        )
+        if export_format == "csv":
+            chunks = iter_csv(rows, serializer.field_names)
+        else:
+            chunks = iter_ndjson(rows)
+        is_gzip = "gzip" in request.headers.get("Accept-Encoding", "")
+        response = StreamingHttpResponse(
+            iter_gzip(chunks) if is_gzip else chunks,
+            content_type=EXPORT_CONTENT_TYPES[export_format],
+        )
+        if is_gzip:
+            response["Content-Encoding"] = "gzip"
+        patch_vary_headers(response, ("Accept-Encoding",))
+        filename = f"trials.{export_format}"
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+
+class TrialsLookupView(APIView):
+    def get(self, request: Request) -> Response:
+        """
+        Get trials by numbers.
+        GET /api/v1/trials/lookup/?number=<number>&number=<number>
+        """
+
+        return self.lookup(request.query_params.getlist("number"))
+
+    def post(self, request: Request) -> Response:
+        """
+        Get trials by numbers.
+        POST /api/v1/trials/lookup/ {"numbers": [<number>, ...]}
+        """
+
+        numbers = (
+            request.data.get("numbers") if isinstance(request.data, dict) else None
+        )
+        if not isinstance(numbers, list) or not all(
+            isinstance(number, str) for number in numbers
+        ):
+            message = "numbers must be a list of strings."
+            return Response({"message": message}, status=HTTP_400_BAD_REQUEST)
+        return self.lookup(numbers)
+
+    def lookup(self, numbers: list[str]) -> Response:
+        """
+        Find the trials with a query.
+        The found trials are in the order of the numbers,
+            and the numbers which are not found are listed in `missing`.
+        """
+        try:
+            numbers = clean_numbers(numbers)
+        except ValueError as e:
+            return Response({"message": str(e)}, status=HTTP_400_BAD_REQUEST)
+        read_model = get_read_model()
+        if read_model is not None:
+            rows = filter(None, map(read_model.get, numbers))
+        else:
+            rows = Trial.objects.filter(number__in=numbers).values(*serializer.sources)
+        return Response(get_lookup_data(numbers, rows))
+
+
+class TrialChangesView(APIView):
+    @cache_response
+    def get(self, request: Request) -> Response:
+        """
+        Get the revisions of trials after a revision id, in order of id.
+        GET /api/v1/trials/changes/?since=<since:0>&limit=<limit:100>
+        GET /api/v1/trials/changes/?since_time=<ISO 8601 datetime>
+        Follow `next` until it is null, and keep `last_id` for the next sync.
+        """
+
+        params = request.query_params
+        since = params.get("since", "0")
+        limit = params.get("limit", str(DEFAULT_CHANGES_LIMIT))
+        if not since.isdigit() or not limit.isdigit():
+            message = "since and limit must be non-negative integers."
+            return Response({"message": message}, status=HTTP_400_BAD_REQUEST)
+        since = int(since)
+        limit = min(int(limit), MAX_CHANGES_LIMIT) or DEFAULT_CHANGES_LIMIT
+        revisions = TrialRevision.objects.filter(id__gt=since).order_by("id")
+        if "since_time" in params:
+            since_time = parse_datetime(params["since_time"])
+            if since_time is None:
+                message = "since_time must be an ISO 8601 datetime."
+                return Response({"message": message}, status=HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(since_time):
+                since_time = timezone.make_aware(since_time)
+            revisions = revisions.filter(created_at__gte=since_time)
+        page = list(revisions[: limit + 1])
+        # Get one more revision to know that there is the next page.
+        has_next = len(page) > limit
+        page = page[:limit]
+        last_id = page[-1].id if page else since
+        next_url = (
+            replace_query_param(request.build_absolute_uri(), "since", last_id)
+            if has_next
+            else None
+        )
+        return Response(
+            {
+                "next": next_url,
+                "last_id": last_id,
+                "results": TrialRevisionSerializer(page, many=True).data,
+            }
+        )
+
+
+class TrialStatsView(APIView):
+    @cache_response
+    def get(self, request: Request) -> Response:
+        """
+        Get the number of trials and the total of their targets
+            for each department, stage, kind and institution.
+        GET /api/v1/trials/stats/?dimension=<dimension>
+        """
+
+        all_dimensions = TrialStat.Dimension.values
+        dimensions = request.query_params.getlist("dimension")
+        for dimension in dimensions:
+            if dimension not in all_dimensions:
+                message = f"dimension must be one of {', '.join(all_dimensions)}."
+                return Response({"message": message}, status=HTTP_400_BAD_REQUEST)
+        dimensions = dimensions or all_dimensions
+        stats = {dimension: [] for dimension in dimensions}
+        rows = (
+            TrialStat.objects.filter(dimension__in=dimensions)
+            .order_by("dimension", "-count", "value")
+            .values("dimension", "value", "count", "target")
+        )
+        for row in rows:
+            stats[row.pop("dimension")].append(row)
+        return Response(stats)
+
+
+class TrialsMetricsView(View):
+    """
+    Metrics for Prometheus.
+    It is not an APIView because the text format is not negotiated by DRF.
+    """
+
+    def get(self, request):
+        """
+        Get the metrics of the last sync and the latency of the requests.
+        GET /api/v1/trials/metrics/
+        """
+
+        return HttpResponse(
+            render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
         )
-        self.set_paginator(request.query_params)
-        page = self.paginator.paginate_queryset(trials, request)
-        serializer = TrialSerializer(page, many=True)
-        return self.paginator.get_paginated_response(serializer.data)
 
 
 class TrialView(APIView):
+    @cache_response
     def get(self, request: Request, pk: str) -> Response:
         """
         Get a trial by number.
         GET /api/v1/trials/{number}
         """
 
-        try:
-            trial = Trial.objects.get(number=pk)
-        except Trial.DoesNotExist:
+        read_model = get_read_model()
+        if read_model is not None:
+            row = read_model.get(pk)
+        else:
+            try:
+                row = Trial.objects.values(*serializer.sources).get(number=pk)
+            except Trial.DoesNotExist:
+                row = None
+        if row is None:
             return Response({"message": "Not found"}, status=HTTP_404_NOT_FOUND)
-        serializer = TrialSerializer(trial)
-        return Response(serializer.data)
+        return Response(serializer.to_representation(row))